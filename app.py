@@ -1,6 +1,7 @@
-import os, uuid, mod, importlib.util
-from flask import Flask, request, jsonify, send_from_directory, render_template
-from video_gen import generate_video, crop_and_resize_for_style
+import os, io, re, time, base64, mod, jobs, cache, workspace, uploads, pyramid, previews, renders, metrics, pool, worker
+from contextlib import contextmanager
+from flask import Flask, Response, g, request, jsonify, send_from_directory, render_template, stream_with_context
+from video_gen import render_frame, ENCODER_PROFILES
 
 app = Flask(__name__)
 
@@ -14,30 +15,93 @@ app.config["UPLOAD_FOLDER"] = UPLOAD_DIR
 app.config['OUTPUT_FOLDER'] = OUTPUT_DIR
 app.config["TEMP_FOLDER"] = TEMP_DIR
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
+# выборочный профилировщик по ?profile=1 или X-Profile: 1; включается только явно
+app.config["PROFILING"] = os.environ.get("VIBEMAKER_PROFILING") == "1"
+# воркеры рендера в этом процессе; 0 - задачи выполняют только отдельно запущенные worker.py
+app.config["LOCAL_WORKERS"] = int(os.environ.get("VIBEMAKER_LOCAL_WORKERS", jobs.LOCAL_WORKERS))
+
+# ответы, к которым добавляется Server-Timing с этапами рендера
+TIMED_ENDPOINTS = {"preview", "preview_image", "generate"}
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(TEMP_DIR, exist_ok=True)
 
-def clear_dir(dir):
-    for f in os.listdir(dir):
-        try:
-            os.remove(os.path.join(dir, f))
-        except Exception as e:
-            print(f"Ошибка удаление файла {f}: {e}")
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    g.timings, g.timings_token = metrics.begin()
+
+@app.before_request
+def open_workspace():
+    workspace.start_janitor(jobs.pinned)
+    worker.start(app.config["LOCAL_WORKERS"])
+    workspace.current()
+
+@app.after_request
+def save_workspace(response):
+    if g.get("new_workspace"):
+        response.set_cookie(workspace.COOKIE_NAME, g.workspace, max_age=workspace.WORKSPACE_TTL, httponly=True, samesite="Lax")
+    return response
+
+@app.after_request
+def add_timing(response):
+    total = time.perf_counter() - g.request_start
+    metrics.observe("vibemaker_request_seconds", total, endpoint=request.endpoint or "unknown")
+
+    if request.endpoint in TIMED_ENDPOINTS:
+        response.headers["Server-Timing"] = metrics.server_timing(g.timings, total)
+    if g.get("profile"):
+        response.headers["X-Profile"] = profile_url(g.profile)
+    return response
+
+@app.teardown_request
+def stop_timing(exc=None):
+    # у потоковых ответов (stream_with_context) teardown вызывается второй раз при закрытии генератора
+    token = g.pop("timings_token", None)
+    if token:
+        metrics.end(token)
+
+def profile_requested():
+    return app.config["PROFILING"] and "1" in (request.args.get("profile"), request.headers.get("X-Profile"))
+
+def profile_url(name):
+    return f"/metrics/profiles/{name}"
+
+@contextmanager
+def profiling(enabled):
+    # профилируется текущий поток; рендер идет в нем же, а не в пуле процессов, иначе его не видно
+    if not enabled:
+        yield
+        return
+
+    with pool.inline(), metrics.Profiler() as profiler:
+        yield
+    g.profile = profiler.save()
 
 @app.route("/")
 def index():
-    clear_dir(app.config["TEMP_FOLDER"])
-    clear_dir(app.config["UPLOAD_FOLDER"])
-
     return render_template("index.html")
 
+def output_name(video_name, target, targets):
+    if len(targets) == 1:
+        return f"{video_name}.mp4"
+
+    same_type = [t for t in targets if t["video_type"] == target["video_type"]]
+    if len(same_type) > 1:
+        return f"{video_name}_{target['video_type']}_{target['video_style']}.mp4"
+    return f"{video_name}_{target['video_type']}.mp4"
+
 @app.route('/generate', methods=['POST'])
 def generate():
     data = request.json
 
-    if not all(key in data for key in ['image', 'audio', 'video_name', 'video_type', 'video_style']):
+    targets = data.get('targets') or [
+        {"video_type": data.get('video_type'), "video_style": data.get('video_style')}
+    ]
+
+    if not all(key in data for key in ['image', 'audio', 'video_name']) or \
+            not all(isinstance(t, dict) and t.get('video_type') and t.get('video_style') for t in targets):
         return jsonify({
             "error": "Не все обязательные поля заполнены"
         }), 400
@@ -48,69 +112,219 @@ def generate():
     
     save_folder = app.config["OUTPUT_FOLDER"]
     os.makedirs(save_folder, exist_ok=True)
-    
-    output_path = os.path.join(save_folder, f"{video_name}.mp4")
+
+    targets = [
+        {
+            "video_type": t['video_type'],
+            "video_style": t['video_style'],
+            "out_path": os.path.join(save_folder, output_name(video_name, t, targets))
+        }
+        for t in targets
+    ]
     mods_cfg = data.get('mods', None)
+    profile = data.get('encoder_profile', 'default')
+
+    if profile not in ENCODER_PROFILES:
+        return jsonify({"error": "Неизвестный профиль кодирования"}), 400
+
+    mod_files = [
+        value for m in mods_cfg or [] if isinstance(m, dict)
+        for value in (m.get("params") or {}).values()
+    ]
+    pins = workspace.pins_for(data['image'], data['audio'], *mod_files) | {workspace.current()}
 
     try:
-        generate_video(
+        job = jobs.submit(
+            "render",
+            workspace.temp_dir(),
             data['image'],
             data['audio'],
-            output_path,
-            data['video_type'],
-            data['style_resize'],
-            data['video_style'],
-            mods_cfg
+            targets,
+            data.get('style_resize', 'default'),
+            mods_cfg,
+            profile,
+            pins=pins,
+            profile_render=profile_requested()
         )
-        
-        return jsonify({
-            "success": True,
-            "message": "Видео успешно сгенерировано!",
-            "video_path": output_path
-        })
-    except Exception as e:
-        return jsonify({"error": f"Ошибка генерации видео: {str(e)}"}), 500
-
-@app.route("/preview", methods=['POST'])
-def preview():
-    import io, base64
-    from PIL import Image
-    from style import apply_style
-
-    data = request.json
+    except jobs.QueueFull as e:
+        return jsonify({"error": str(e)}), 503
+
+    return jsonify({
+        "success": True,
+        "message": "Видео поставлено в очередь",
+        "job_id": job.id
+    }), 202
+
+@jobs.task("render")
+def render_job(temp_dir, *args, profile_render=False, job=None):
+    with app.app_context():
+        g.temp_dir = temp_dir
+        with profiling(profile_render):
+            paths = renders.generate(*args, job=job)
+
+        result = {"video_path": paths[0], "video_paths": paths}
+        if g.get("profile"):
+            result["profile"] = profile_url(g.profile)
+        return result
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Задача не найдена"}), 404
+
+    response = jsonify(job.to_dict())
+    # этапы самого рендера: /generate только ставит задачу в очередь
+    if job.timings:
+        response.headers["Server-Timing"] = metrics.server_timing(list(job.timings))
+    return response
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Задача не найдена"}), 404
+
+    if not jobs.cancel(job_id):
+        return jsonify({"error": "Задача уже завершена"}), 409
+
+    return jsonify({"success": True, "message": "Генерация отменена"})
+
+PREVIEW_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp")
+}
+
+def render_preview(data, max_size=None):
     img_path = data.get('image_path')
     vid_type = data.get('video_type', 'YouTube')
     res_type = data.get('style_resize', 'default')
     vid_style = data.get('video_style', 'black')
     mods_cfg = data.get('mods', None)
 
-    if not os.path.exists(img_path):
+    return render_frame(img_path, vid_type, res_type, vid_style, mods_cfg, max_size)
+
+@app.route("/preview", methods=['POST'])
+def preview():
+    data = request.json
+    img_path = data.get('image_path')
+
+    if not img_path or not os.path.exists(img_path):
         return jsonify({
             "error": "Изображение не найдено"
         }), 400
     
     try:
-        main_img = crop_and_resize_for_style(img_path, res_type)
+        with profiling(profile_requested()):
+            img = render_preview(data, data.get('max_size'))
 
-        with Image.open(main_img) as img:
-            img = mod.apply_mods(img, mods_cfg)
+        buf = io.BytesIO()
+        with metrics.timed("encode_image", "png"):
+            img.save(buf, format="PNG")
+        encoded = base64.b64encode(buf.getvalue()).decode("utf-8")
+
+        return jsonify({
+            "preview": f"data:image/png;base64,{encoded}"
+        })
+    except Exception as e:
+        return jsonify({
+            "error": f"Ошибка генерации предпросмотра: {str(e)}"
+        }), 500
 
-            img = apply_style(
-                img, vid_type, vid_style
-            )
+def encode_preview(img, fmt, quality):
+    pil_format, mimetype = PREVIEW_FORMATS[fmt]
+    buf = io.BytesIO()
+    with metrics.timed("encode_image", fmt):
+        img.convert("RGB").save(buf, format=pil_format, quality=quality)
+    return buf.getvalue(), mimetype
 
-            buf = io.BytesIO()
-            img.save(buf, format="PNG")
-            encoded = base64.b64encode(buf.getvalue()).decode("utf-8")
+@app.route("/preview/image", methods=['POST'])
+def preview_image():
+    data = request.json
+    img_path = data.get('image_path')
+    fmt = data.get('format', 'jpeg')
 
-            return jsonify({
-                "preview": f"data:image/png;base64,{encoded}"
-            })
+    if not img_path or not os.path.exists(img_path):
+        return jsonify({
+            "error": "Изображение не найдено"
+        }), 400
+
+    if fmt not in PREVIEW_FORMATS:
+        return jsonify({
+            "error": "Неподдерживаемый формат превью"
+        }), 400
+
+    try:
+        max_size = int(data.get('max_size', 960))
+        quality = int(data.get('quality', 85))
+
+        with profiling(profile_requested()):
+            img = render_preview(data, max_size)
+
+        body, mimetype = encode_preview(img, fmt, quality)
+        return Response(body, mimetype=mimetype, headers={"Cache-Control": "no-store"})
     except Exception as e:
         return jsonify({
             "error": f"Ошибка генерации предпросмотра: {str(e)}"
         }), 500
 
+# id вкладки браузера; у каждой вкладки свой канал превью
+CLIENT_RE = re.compile(r"^[\w-]{1,64}$")
+
+def render_channel_frame(data):
+    # кадр для канала превью: картинка data URL и этапы в формате Server-Timing
+    start = time.perf_counter()
+    with metrics.collect() as timings:
+        img = render_preview(data, int(data.get('max_size', 960)))
+        body, mimetype = encode_preview(img, data.get('format', 'jpeg'), int(data.get('quality', 85)))
+
+    total = time.perf_counter() - start
+    metrics.observe("vibemaker_request_seconds", total, endpoint="preview_channel")
+    return {
+        "preview": f"data:{mimetype};base64,{base64.b64encode(body).decode('ascii')}",
+        "timing": metrics.server_timing(timings, total)
+    }
+
+@app.route("/preview/stream", methods=['GET'])
+def preview_stream():
+    # поток событий SSE: в него приходит готовый кадр последнего запроса из /preview/submit
+    client = request.args.get('client', '')
+    if not CLIENT_RE.match(client):
+        return jsonify({"error": "Неверный id клиента"}), 400
+
+    channel = previews.get((workspace.current(), client))
+    return Response(
+        stream_with_context(previews.stream(channel, render_channel_frame)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/preview/submit", methods=['POST'])
+def preview_submit():
+    # ставит запрос превью в канал вкладки; еще не начатый или идущий рендер прошлого запроса отменяется
+    data = request.json or {}
+    client = data.get('client') or ''
+    img_path = data.get('image_path')
+
+    if not CLIENT_RE.match(client):
+        return jsonify({"error": "Неверный id клиента"}), 400
+
+    if not img_path or not os.path.exists(img_path):
+        return jsonify({"error": "Изображение не найдено"}), 400
+
+    if data.get('format', 'jpeg') not in PREVIEW_FORMATS:
+        return jsonify({"error": "Неподдерживаемый формат превью"}), 400
+
+    seq = previews.get((workspace.current(), client)).submit(data)
+    return jsonify({"seq": seq}), 202
+
+def upload_result(path, original_name):
+    return {
+        "filename": os.path.basename(path),
+        "original_name": original_name,
+        "path": path
+    }
+
 @app.route("/upload", methods=["POST"])
 def upload_file():
     file = request.files.get("file")
@@ -122,42 +336,83 @@ def upload_file():
         }), 400
     
     ext = os.path.splitext(file.filename)[1].lower()
-    filename = f"{uuid.uuid4().hex}{ext}"
-    file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
 
     try:
-        file.save(file_path)
-
+        part_path, digest = uploads.save_stream(file.stream, workspace.temp_dir(), ext)
+        file_path = uploads.finish(part_path, digest, ext, type, workspace.upload_dir())
         if type == "image":
-            from PIL import Image
-            with Image.open(file_path) as img:
-                # if img.mode != "RGB":
-                #     img = img.convert("RGB")
-
-                _, h = img.size
-                # w, h = img.size
-
-                # if h < 1080:
-                #     scale = 1080 / h
-                #     new_size = (int(w * scale), 1080)
-                #     img = img.resize(new_size, resample=Image.LANCZOS)
-
-                # img.save(file_path)
-
-            if h < 1080:
-                os.remove(file_path)
-                return jsonify({
-                    "error": "Высота изображения должна быть не менее 1080px"
-                }), 400
-                
+            pyramid.schedule(file_path)
+
+        return jsonify(upload_result(file_path, file.filename))
+    except ValueError as e:
         return jsonify({
-            "filename": filename,
-            "original_name": file.filename,
-            "path": file_path
-        })
+            "error": str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            "error": f"Ошибка загрузки файла: {str(e)}"
+        }), 500
+
+@app.route("/upload/init", methods=["POST"])
+def upload_init():
+    # начало загрузки по частям; если эта рабочая папка уже загружала файл с таким sha256, загрузка не нужна
+    data = request.json or {}
+    filename = data.get("filename") or ""
+    type = data.get("type")
+    ext = os.path.splitext(filename)[1].lower()
+
+    try:
+        file_path = uploads.owned(data.get("sha256"), ext, workspace.upload_dir())
+        if file_path:
+            if type == "image":
+                pyramid.schedule(file_path)
+            return jsonify(upload_result(file_path, filename))
+
+        upload = uploads.start(workspace.current(), filename, data.get("size"), type, workspace.temp_dir())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "upload_id": upload.id,
+        "offset": 0,
+        "chunk_size": uploads.CHUNK_SIZE
+    })
+
+@app.route("/upload/<upload_id>", methods=["GET", "PUT", "DELETE"])
+def upload_chunk(upload_id):
+    upload = uploads.get(upload_id, workspace.current())
+    if not upload:
+        return jsonify({"error": "Загрузка не найдена"}), 404
+
+    if request.method == "GET":
+        return jsonify({"offset": upload.received, "size": upload.size})
+
+    if request.method == "DELETE":
+        uploads.cancel(upload)
+        return jsonify({"success": True})
+
+    # Content-Range: bytes начало-конец/размер
+    content_range = request.headers.get("Content-Range", "")
+    try:
+        offset = int(content_range.split(" ", 1)[1].split("-", 1)[0])
+    except (IndexError, ValueError):
+        return jsonify({"error": "Нужен заголовок Content-Range"}), 400
+
+    if offset != upload.received:
+        return jsonify({"error": "Неверное смещение", "offset": upload.received}), 409
+
+    try:
+        received = uploads.write(upload, offset, request.stream)
+        if not upload.complete:
+            return jsonify({"offset": received})
+
+        file_path = uploads.complete(upload, workspace.upload_dir())
+        if upload.kind == "image":
+            pyramid.schedule(file_path)
+        return jsonify(upload_result(file_path, upload.filename))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        if os.path.exists(file_path):
-            os.remove(file_path)
         return jsonify({
             "error": f"Ошибка загрузки файла: {str(e)}"
         }), 500
@@ -166,22 +421,23 @@ def upload_file():
 def download_file(filename):
     return send_from_directory(app.config['OUTPUT_FOLDER'], filename, as_attachment=True)
 
-@app.route('/mods', methods=['POST'])
+@app.route('/mods', methods=['GET', 'POST'])
 def get_all_mods():
     mods = mod.get_mods()
-    return jsonify({"mods": mods})
+
+    response = jsonify({"mods": mods})
+    response.set_etag(mod.get_mods_etag())
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
 
 @app.route("/mods/<mod_name>/<button_name>", methods=["POST"])
 def mod_button_action(mod_name, button_name):
     try:
-        mod_path = os.path.join(mod.MODS_DIR, f"{mod_name}.py")
-        if not os.path.exists(mod_path):
+        try:
+            mod_module = mod.get_mod(mod_name).module
+        except FileNotFoundError:
             return jsonify({"error": "Мод не найден"}), 404
 
-        spec = importlib.util.spec_from_file_location(mod_name, mod_path)
-        mod_module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(mod_module)
-
         if not hasattr(mod_module, "on_button_click"):
             return jsonify({"error": "Мод не поддерживает кнопки"}), 400
 
@@ -195,5 +451,19 @@ def mod_button_action(mod_name, button_name):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    return jsonify({"caches": cache.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/metrics/profiles/<name>', methods=['GET'])
+def metrics_profile(name):
+    if not app.config["PROFILING"]:
+        return jsonify({"error": "Профилирование выключено"}), 404
+    return send_from_directory(metrics.PROFILE_DIR, name, mimetype="text/plain")
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
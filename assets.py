@@ -0,0 +1,48 @@
+import os
+from PIL import Image, ImageFont
+from cache import LRUCache, sizeof
+
+# шрифты, картинки и маски, которые моды строят из файлов и параметров;
+# у каждого процесса пула свой кеш, бюджет - на процесс
+asset_cache = LRUCache("mod_assets", 96 * 1024 * 1024, lambda v: v[1])
+
+def file_key(path):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+def nbytes(value):
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    return sizeof(value)
+
+def get(key, build, path=None, size=None):
+    # key - производные параметры (размер, масштаб, форма...); path добавляет к ключу файл и его mtime,
+    # так что измененный файл строится заново. Результат общий: менять его на месте нельзя
+    full_key = (key, file_key(path) if path else None)
+
+    cached = asset_cache.get(full_key)
+    if cached is not None:
+        return cached[0]
+
+    value = build()
+    asset_cache.put(full_key, (value, nbytes(value) if size is None else size))
+    return value
+
+def font(path, size):
+    return get(("font", size), lambda: ImageFont.truetype(path, size=size), path, os.path.getsize(path))
+
+def image(path, mode="RGBA", size=None, scale=1.0, resample=Image.LANCZOS):
+    # картинка из файла в нужном режиме; size - точный размер, scale - доля исходного
+    def build():
+        with Image.open(path) as img:
+            result = img.convert(mode)
+
+        target = size or (int(result.width * scale), int(result.height * scale))
+        if target != result.size:
+            result = result.resize(target, resample)
+        return result
+
+    return get(("image", mode, size, scale, resample), build, path)
+
+def solid(mode, size, color="black"):
+    return get(("solid", mode, size, color), lambda: Image.new(mode, size, color))
@@ -0,0 +1,256 @@
+import os, struct, subprocess, json, mmap, metrics
+from cache import LRUCache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FFPROBE_PATH = os.path.join(BASE_DIR, "ffmpeg", "ffprobe.exe")
+
+probe_cache = LRUCache("audio_probe", 1024, lambda v: 1)
+
+MP3_BITRATES = {
+    # (версия MPEG 1 или 2, слой): кбит/с по индексу
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+}
+
+MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],   # MPEG 1
+    2: [22050, 24000, 16000],   # MPEG 2
+    0: [11025, 12000, 8000]     # MPEG 2.5
+}
+
+def _info(duration, sample_rate, channels, codec):
+    return {
+        "duration": float(duration),
+        "sample_rate": int(sample_rate),
+        "channels": int(channels),
+        "codec": codec
+    }
+
+def _skip_id3(data):
+    if data[:3] != b"ID3" or len(data) < 10:
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+def _read_wav(data):
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        chunk_size = struct.unpack_from("<I", data, pos + 4)[0]
+        body = pos + 8
+
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack_from("<HHIIHH", data, body)
+            if fmt[0] == 0xFFFE and chunk_size >= 26:
+                fmt = (struct.unpack_from("<H", data, body + 24)[0],) + fmt[1:]
+
+        elif chunk_id == b"data" and fmt:
+            audio_format, channels, sample_rate, byte_rate, _, bits = fmt
+            if not byte_rate:
+                return None
+
+            match audio_format:
+                case 1:
+                    codec = "pcm_u8" if bits == 8 else f"pcm_s{bits}le"
+                case 3:
+                    codec = f"pcm_f{bits}le"
+                case _:
+                    return None
+
+            # размер data может быть не дописан или больше файла
+            data_size = min(chunk_size, len(data) - body)
+            return _info(data_size / byte_rate, sample_rate, channels, codec)
+
+        pos = body + chunk_size + (chunk_size & 1)
+
+    return None
+
+def _mp3_header(data, pos):
+    if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        return None
+
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+    version_bits = (b1 >> 3) & 3
+    layer = 4 - ((b1 >> 1) & 3)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+
+    if version_bits == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    version = 1 if version_bits == 3 else 2
+    bitrate = MP3_BITRATES[(version, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version_bits][rate_index]
+    padding = (b2 >> 1) & 1
+    channels = 1 if (b3 >> 6) == 3 else 2
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or version == 1:
+        samples = 1152
+        length = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 576
+        length = 72 * bitrate // sample_rate + padding
+
+    return {
+        "version": version,
+        "layer": layer,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "samples": samples,
+        "length": length
+    }
+
+def _find_mp3_frame(data, pos, limit=64 * 1024):
+    end = min(len(data), pos + limit)
+    while pos < end:
+        pos = data.find(b"\xFF", pos, end)
+        if pos < 0:
+            return None, None
+        header = _mp3_header(data, pos)
+        # проверяем, что следующий кадр тоже валиден, чтобы не поймать ложную синхронизацию
+        if header and (_mp3_header(data, pos + header["length"]) or pos + header["length"] >= len(data)):
+            return pos, header
+        pos += 1
+    return None, None
+
+def _read_mp3(data):
+    pos, first = _find_mp3_frame(data, _skip_id3(data), 4096)
+    if first is None:
+        return None
+
+    codec = {1: "mp1", 2: "mp2", 3: "mp3"}[first["layer"]]
+
+    # Xing/Info и VBRI хранят точное число кадров
+    if first["version"] == 1:
+        side_info = 17 if first["channels"] == 1 else 32
+    else:
+        side_info = 9 if first["channels"] == 1 else 17
+
+    xing = pos + 4 + side_info
+    if data[xing:xing + 4] in (b"Xing", b"Info"):
+        flags = struct.unpack_from(">I", data, xing + 4)[0]
+        if flags & 1:
+            frames = struct.unpack_from(">I", data, xing + 8)[0]
+            return _info(frames * first["samples"] / first["sample_rate"], first["sample_rate"], first["channels"], codec)
+
+    vbri = pos + 36
+    if data[vbri:vbri + 4] == b"VBRI":
+        frames = struct.unpack_from(">I", data, vbri + 14)[0]
+        return _info(frames * first["samples"] / first["sample_rate"], first["sample_rate"], first["channels"], codec)
+
+    samples = 0
+    while pos is not None:
+        header = _mp3_header(data, pos)
+        if header is None or header["length"] <= 0:
+            pos, header = _find_mp3_frame(data, pos + 1)
+            if header is None:
+                break
+        samples += header["samples"]
+        pos += header["length"]
+
+    return _info(samples / first["sample_rate"], first["sample_rate"], first["channels"], codec)
+
+def _read_flac(data):
+    pos = _skip_id3(data)
+    if data[pos:pos + 4] != b"fLaC" or (data[pos + 4] & 0x7F) != 0:
+        return None
+
+    info = data[pos + 8 + 10:pos + 8 + 18]
+    value = int.from_bytes(info, "big")
+    sample_rate = value >> 44
+    channels = ((value >> 41) & 0x7) + 1
+    total_samples = value & 0xFFFFFFFFF
+
+    if not sample_rate or not total_samples:
+        return None
+
+    return _info(total_samples / sample_rate, sample_rate, channels, "flac")
+
+def _read_ogg(data):
+    if data[:4] != b"OggS":
+        return None
+
+    segments = data[26]
+    packet = 27 + segments
+
+    if data[packet:packet + 7] == b"\x01vorbis":
+        channels = data[packet + 11]
+        sample_rate = struct.unpack_from("<I", data, packet + 12)[0]
+        codec, pre_skip, rate = "vorbis", 0, sample_rate
+    elif data[packet:packet + 8] == b"OpusHead":
+        channels = data[packet + 9]
+        pre_skip = struct.unpack_from("<H", data, packet + 10)[0]
+        codec, sample_rate, rate = "opus", 48000, 48000
+    else:
+        return None
+
+    # длительность - гранула последней страницы
+    last = data.rfind(b"OggS", max(0, len(data) - 256 * 1024))
+    if last < 0:
+        return None
+    granule = struct.unpack_from("<q", data, last + 6)[0]
+    if granule <= 0:
+        return None
+
+    return _info(max(0, granule - pre_skip) / rate, sample_rate, channels, codec)
+
+def _ffprobe(path):
+    with metrics.timed("ffprobe"):
+        result = subprocess.run([
+            FFPROBE_PATH, '-v', 'error',
+            '-select_streams', 'a:0',
+            '-show_entries', 'format=duration:stream=codec_name,sample_rate,channels',
+            '-of', 'json', path
+        ], capture_output=True, text=True)
+
+    if result.returncode:
+        raise RuntimeError(f"ffprobe error: {result.stderr}")
+
+    data = json.loads(result.stdout)
+    stream = (data.get("streams") or [{}])[0]
+
+    return _info(
+        data['format']['duration'],
+        stream.get("sample_rate", 0),
+        stream.get("channels", 0),
+        stream.get("codec_name")
+    )
+
+def read_audio_info(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for reader in (_read_wav, _read_flac, _read_ogg, _read_mp3):
+                try:
+                    info = reader(data)
+                except (struct.error, IndexError, KeyError, ZeroDivisionError):
+                    info = None
+                if info:
+                    return info
+    return None
+
+def probe_audio(path):
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+
+    info = probe_cache.get(key)
+    if info is None:
+        with metrics.timed("probe"):
+            info = read_audio_info(path) or _ffprobe(path)
+        probe_cache.put(key, info)
+
+    return dict(info)
@@ -0,0 +1,267 @@
+import os, sys, gc, json, time, ctypes, argparse, platform, threading, tempfile, statistics, tracemalloc
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw
+
+import mod, style, cache
+from video_gen import crop_and_resize, fit_to_canvas
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(BASE_DIR, "benchmark_baseline.json")
+
+SIZES = {
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+    "8k": (7680, 4320),
+    "tall": (1440, 3840),
+    "wide": (5760, 1440)
+}
+
+VIDEO_TYPES = ["YouTube", "Instagram", "TikTok"]
+VIDEO_STYLES = ["black", "blur", "color"]
+
+# параметры, при которых мод действительно что-то делает; остальное - значения по умолчанию из metadata
+MOD_PARAMS = {
+    "blur": {"radius": 10},
+    "noise": {"intensity": 30, "seed": 1},
+    "text_overlay": {"text": "VibeMaker"},
+    "darken": {"enhance": 0.7},
+    "rotate": {"angle": 15}
+}
+
+# изменения быстрее этого считаем шумом измерений
+NOISE_FLOOR_MS = 2.0
+
+def read_rss():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def trim_heap():
+    # glibc держит освобожденную память у себя, и пик следующего этапа не виден; возвращаем ее системе
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+class RSSSampler:
+    # пик RSS за время этапа: фоновый поток опрашивает память процесса
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start = read_rss()
+        self.peak = self.start
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = read_rss()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def delta(self):
+        if self.start is None or self.peak is None:
+            return None
+        return max(0, self.peak - self.start)
+
+def measure(fn, repeat):
+    # каждый прогон холодный: кеши модов (шрифты, оверлеи, маски), цепочек, исходников и фонов
+    # очищаются, иначе со второго прогона меряются попадания в кеш, а не стоимость этапа
+    cache.clear_all()
+    trim_heap()
+    Image.core.reset_stats()
+
+    # первый прогон: по нему пик памяти и число новых картинок Pillow
+    with RSSSampler() as sampler:
+        fn()
+    images = Image.core.get_stats()["new_count"]
+
+    times = []
+    for _ in range(repeat):
+        cache.clear_all()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    # аллокации меряем отдельным прогоном: tracemalloc замедляет код;
+    # видны аллокации Python и numpy, внутренние буферы Pillow - только в пике RSS
+    cache.clear_all()
+    tracemalloc.start()
+    fn()
+    _, alloc_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "median_ms": round(statistics.median(times), 3),
+        "min_ms": round(min(times), 3),
+        "peak_rss_mb": None if sampler.delta is None else round(sampler.delta / 1024 / 1024, 2),
+        "alloc_peak_mb": round(alloc_peak / 1024 / 1024, 2),
+        "pil_images": images
+    }
+
+def synthetic_image(size, seed=0):
+    # плавные градиенты с шумом - похоже на фото и честно сжимается в JPEG
+    w, h = size
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, w, dtype=np.float32)
+    y = np.linspace(0, 1, h, dtype=np.float32)[:, None]
+    base = np.stack([x * 255 + y * 0, y * 255 + x * 0, (x + y) * 127], axis=-1)
+    noise = rng.normal(0, 12, (h, w, 1)).astype(np.float32)
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+def synthetic_overlay(path):
+    overlay = Image.new("RGBA", (400, 300), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    draw.ellipse((20, 20, 380, 280), fill=(255, 80, 40, 160))
+    overlay.save(path)
+
+def mod_params(entry, assets):
+    params = {
+        param["name"]: param["default"]
+        for param in (entry.metadata or {}).get("params", [])
+        if "default" in param
+    }
+
+    for param in (entry.metadata or {}).get("params", []):
+        if param.get("type") == "file" and "image" in param.get("accept", ""):
+            params[param["name"]] = assets["overlay"]
+
+    params.update(MOD_PARAMS.get(entry.name, {}))
+    return entry.filter_params(params)
+
+def discover_mods(names=None):
+    entries = []
+    for metadata in mod.get_mods():
+        name = metadata.get("name")
+        if names and name not in names:
+            continue
+        entries.append(mod.get_mod(name))
+    return entries
+
+def run(sizes, repeat, mod_names=None):
+    results = {}
+    tmp = tempfile.mkdtemp(prefix="vibemaker_bench_")
+    assets = {"overlay": os.path.join(tmp, "overlay.png")}
+    synthetic_overlay(assets["overlay"])
+    entries = discover_mods(mod_names)
+
+    def record(key, fn):
+        results[key] = measure(fn, repeat)
+        r = results[key]
+        rss = "-" if r["peak_rss_mb"] is None else f"{r['peak_rss_mb']:.1f}"
+        print(
+            f"{key:<40} {r['median_ms']:>9.2f} ms  {r['min_ms']:>9.2f} min  "
+            f"{rss:>7} MB rss  {r['alloc_peak_mb']:>7.1f} MB alloc  {r['pil_images']:>4} img",
+            flush=True
+        )
+
+    try:
+        for size_name in sizes:
+            img = synthetic_image(SIZES[size_name])
+            path = os.path.join(tmp, f"{size_name}.jpg")
+            img.save(path, quality=92)
+
+            # загрузка исходника: JPEG с диска, как при генерации
+            record(f"source/default/{size_name}", lambda: crop_and_resize(path))
+            record(f"source/fullscreen/{size_name}", lambda: fit_to_canvas(path))
+
+            for entry in entries:
+                params = mod_params(entry, assets)
+                record(f"mod/{entry.name}/{size_name}", lambda: entry.module.apply(img.copy(), **params))
+
+            if entries:
+                cfg = [{"name": entry.name, "params": mod_params(entry, assets)} for entry in entries]
+                record(f"apply_mods/all/{size_name}", lambda: mod.apply_mods(img, cfg))
+
+            for vid_type in VIDEO_TYPES:
+                for vid_style in VIDEO_STYLES:
+                    # без cache_key: фон считается заново на каждом прогоне
+                    record(f"style/{vid_type}/{vid_style}/{size_name}", lambda: style.apply_style(img, vid_type, vid_style))
+    finally:
+        for name in os.listdir(tmp):
+            os.remove(os.path.join(tmp, name))
+        os.rmdir(tmp)
+
+    return results
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+
+        # сравниваем лучшие прогоны: они меньше всего зависят от фоновой нагрузки
+        slower = result["min_ms"] - base["min_ms"]
+        if slower > NOISE_FLOOR_MS and result["min_ms"] > base["min_ms"] * (1 + threshold):
+            regressions.append((key, base["min_ms"], result["min_ms"]))
+
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера обработки изображений VibeMaker")
+    parser.add_argument("--sizes", default="1080p,4k,tall,wide", help=f"через запятую: {', '.join(SIZES)}")
+    parser.add_argument("--mods", default=None, help="только эти моды, через запятую")
+    parser.add_argument("--repeat", type=int, default=5, help="прогонов на этап")
+    parser.add_argument("--save", nargs="?", const=BASELINE_FILE, default=None, help="сохранить результаты как baseline")
+    parser.add_argument("--compare", nargs="?", const=BASELINE_FILE, default=None, help="сравнить с baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="допустимое замедление, доля (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f"неизвестные размеры: {', '.join(unknown)}")
+
+    mod_names = {m.strip() for m in args.mods.split(",")} if args.mods else None
+    results = run(sizes, max(1, args.repeat), mod_names)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "meta": {
+                    "python": platform.python_version(),
+                    "pillow": PIL.__version__,
+                    "numpy": np.__version__,
+                    "platform": platform.platform(),
+                    "created": time.strftime("%Y-%m-%d %H:%M:%S")
+                },
+                "results": results
+            }, f, ensure_ascii=False, indent=2)
+        print(f"Baseline сохранен: {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+        regressions = compare(results, baseline, args.threshold)
+        for key, before, after in regressions:
+            print(f"РЕГРЕССИЯ {key}: {before:.2f} -> {after:.2f} ms ({after / before - 1:+.0%})")
+
+        if regressions:
+            return 1
+        print("Регрессий нет")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import threading, time, uuid, render_queue
+
+# воркеры рендера внутри веб-процесса; 0 - веб только ставит задачи, рендерят отдельные worker.py
+LOCAL_WORKERS = 2
+MAX_PENDING = 16
+
+class JobCancelled(Exception):
+    pass
+
+class QueueFull(RuntimeError):
+    pass
+
+class Job:
+    # задача, которую выполняет воркер: прогресс, отмена и процесс ffmpeg, который нужно убить при отмене
+    def __init__(self, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.status = "queued"
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.process = None
+        # замеры этапов рендера для Server-Timing
+        self.timings = []
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def set_progress(self, percent):
+        self.progress = round(max(0.0, min(100.0, percent)), 1)
+
+    def attach(self, process):
+        with self._lock:
+            self.process = process
+            if self.cancelled:
+                process.kill()
+
+    def detach(self):
+        with self._lock:
+            self.process = None
+
+    def cancel(self):
+        if not self.active:
+            return False
+
+        self._cancel.set()
+        with self._lock:
+            if self.status == "queued":
+                self.status = "cancelled"
+                self.finished = time.time()
+            if self.process and self.process.poll() is None:
+                self.process.kill()
+        return True
+
+class JobStatus:
+    # состояние задачи из очереди для веба
+    def __init__(self, record):
+        self.id = record["id"]
+        self.status = record["status"]
+        self.progress = record["progress"]
+        self.result = record["result"]
+        self.error = record["error"]
+        self.attempts = record["attempts"]
+        self.timings = record["timings"]
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def to_dict(self):
+        # dead - все попытки исчерпаны; для страницы это обычная ошибка
+        dead = self.status == "dead"
+        return {
+            "id": self.id,
+            "status": "error" if dead else self.status,
+            "progress": self.progress,
+            "result": self.result,
+            "error": f"{self.error} (попыток: {self.attempts})" if dead else self.error
+        }
+
+# задачи по имени: в очереди хранится имя и аргументы в JSON, функцию находит воркер
+tasks = {}
+
+def task(name):
+    def register(fn):
+        tasks[name] = fn
+        return fn
+    return register
+
+def submit(name, *args, pins=(), **kwargs):
+    if name not in tasks:
+        raise ValueError(f"Неизвестная задача: {name}")
+
+    job_id = render_queue.enqueue(name, args, kwargs, pins, MAX_PENDING)
+    if job_id is None:
+        raise QueueFull("Очередь рендера переполнена, попробуйте позже")
+    return get(job_id)
+
+def get(job_id):
+    record = render_queue.get(job_id)
+    return JobStatus(record) if record else None
+
+def cancel(job_id):
+    return render_queue.request_cancel(job_id)
+
+def pinned():
+    return render_queue.pinned()
@@ -0,0 +1,175 @@
+import os, re, sys, time, threading, contextvars, uuid
+from collections import Counter
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# свернутые стеки профилировщика (формат flamegraph.pl / speedscope)
+PROFILE_DIR = os.path.join(BASE_DIR, "cache", "profiles")
+PROFILE_INTERVAL = 0.005
+PROFILE_KEEP = 50
+
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+FPS_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+SPEED_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 25, 50, 100, 250)
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # метки -> [счетчики по корзинам, сумма, количество]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, n in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(key, le=bound)} {n}")
+                lines.append(f"{self.name}_bucket{_labels(key, le='+Inf')} {count}")
+                lines.append(f"{self.name}_sum{_labels(key)} {total:.6f}")
+                lines.append(f"{self.name}_count{_labels(key)} {count}")
+        return lines
+
+def _labels(key, **extra):
+    items = list(key) + [(k, v) for k, v in extra.items()]
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+histograms = {
+    h.name: h for h in (
+        Histogram("vibemaker_stage_seconds", "Длительность этапов рендера", TIME_BUCKETS),
+        Histogram("vibemaker_request_seconds", "Длительность HTTP-запросов", TIME_BUCKETS),
+        Histogram("vibemaker_ffmpeg_fps", "Скорость кодирования ffmpeg, кадров в секунду", FPS_BUCKETS),
+        Histogram("vibemaker_ffmpeg_speed", "Скорость кодирования ffmpeg относительно длительности видео", SPEED_BUCKETS)
+    )
+}
+
+def observe(name, value, **labels):
+    histograms[name].observe(value, **{k: v for k, v in labels.items() if v is not None})
+
+def render():
+    lines = []
+    for histogram in histograms.values():
+        lines += histogram.render()
+    return "\n".join(lines) + "\n"
+
+# этапы текущего запроса или задачи: [(этап, уточнение, секунды, описание)]
+_timings = contextvars.ContextVar("timings", default=None)
+
+@contextmanager
+def collect(timings=None):
+    timings = [] if timings is None else timings
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+def begin():
+    # для пары before_request / teardown_request, где with не подходит
+    timings = []
+    return timings, _timings.set(timings)
+
+def end(token):
+    _timings.reset(token)
+
+def record(stage, seconds, detail=None, desc=None):
+    observe("vibemaker_stage_seconds", seconds, stage=stage, detail=detail)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((stage, detail, seconds, desc))
+
+def merge(timings):
+    # этапы, замеренные в процессе пула
+    for stage, detail, seconds, desc in timings or ():
+        record(stage, seconds, detail, desc)
+
+@contextmanager
+def timed(stage, detail=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start, detail)
+
+_TOKEN_RE = re.compile(r"[^\w.-]")
+
+def server_timing(timings, total=None):
+    # одинаковые этапы складываются; в desc - сколько раз этап выполнялся или скорость ffmpeg
+    totals = {}
+    for stage, detail, seconds, desc in timings:
+        name = _TOKEN_RE.sub("_", f"{stage}.{detail}" if detail else stage)
+        entry = totals.setdefault(name, [0.0, 0, None])
+        entry[0] += seconds * 1000
+        entry[1] += 1
+        entry[2] = desc or entry[2]
+
+    parts = []
+    for name, (ms, count, desc) in totals.items():
+        desc = desc or (f"{count}x" if count > 1 else None)
+        parts.append(f"{name};dur={ms:.1f}" + (f';desc="{desc}"' if desc else ""))
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+class Profiler:
+    # выборочный профилировщик одного потока: раз в interval снимает его стек
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="profiler")
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def save(self):
+        # имя файла в PROFILE_DIR; старые профили удаляются
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}.folded"
+        with open(os.path.join(PROFILE_DIR, name), "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        profiles = sorted(os.listdir(PROFILE_DIR))
+        for old in profiles[:-PROFILE_KEEP]:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, old))
+            except OSError:
+                pass
+        return name
@@ -1,55 +1,337 @@
-import importlib.util, os, glob, inspect
+import importlib.util, os, glob, inspect, threading, hashlib, json, uuid, metrics, pool, reactive
 from PIL import Image
+from cache import LRUCache
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODS_DIR = os.path.join(BASE_DIR, "mods")
 
+prefix_cache = LRUCache("mod_chain", 256 * 1024 * 1024)
+
+# параметры времени анимированных модов: их подставляет движок, а не пользователь
+TIME_PARAMS = {"t", "frame", "period"}
+# масштаб прокси-превью для модов, у которых размер задан не в пикселях (проценты от размера файла)
+SCALE_PARAM = "px_scale"
+
+class LoadedMod:
+    def __init__(self, name, module, mtime):
+        self.name = name
+        self.module = module
+        self.mtime = mtime
+        self.metadata = getattr(module, "metadata", None)
+
+        if hasattr(module, "apply"):
+            signature = inspect.signature(module.apply).parameters
+            self.params = set(signature.keys())
+            self.defaults = {name: p.default for name, p in signature.items() if p.default is not p.empty}
+        else:
+            self.params = set()
+            self.defaults = {}
+
+        self.px_params = {
+            param["name"] for param in (self.metadata or {}).get("params", [])
+            if param.get("unit") == "px"
+        }
+        self.sliders = {
+            param["name"]: param for param in (self.metadata or {}).get("params", [])
+            if param.get("type") == "slider"
+        }
+
+        capabilities = getattr(module, "capabilities", None) or {}
+        # режимы, которые мод принимает без конвертации; None - мод без объявленных возможностей
+        self.modes = capabilities.get("modes")
+        # таблица Image.point по параметрам: подряд идущие такие моды склеиваются в один проход
+        self.lut = getattr(module, "lut", None) if capabilities.get("lut") else None
+
+        # мод анимирован, если apply принимает время; is_animated(**params) уточняет, есть ли движение при этих параметрах
+        self.time_params = self.params & TIME_PARAMS
+        self.is_animated = getattr(module, "is_animated", None)
+        # is_random(**params): результат при этих параметрах каждый раз новый (случайное зерно)
+        self.is_random = getattr(module, "is_random", None)
+
+    def animated(self, params):
+        if not self.time_params:
+            return False
+        return bool(self.is_animated(**params)) if self.is_animated else True
+
+    def random(self, params):
+        return bool(self.is_random(**params)) if self.is_random else False
+
+    def react_value(self, name, params, amount, level, bounds):
+        # значение параметра, который двигает звук: базовое + amount * уровень, в пределах слайдера
+        base = params.get(name, self.defaults.get(name, 0))
+        low, high = bounds
+        value = base + amount * level
+
+        if low is not None:
+            value = max(value, low)
+        if high is not None:
+            value = min(value, high)
+        # целый шаг слайдера - целое значение, как если бы его выставили вручную
+        return round(value) if float(self.sliders[name].get("step", 1)).is_integer() else value
+
+    def filter_params(self, params, scale=1.0):
+        params = {k: v for k, v in params.items() if k in self.params - TIME_PARAMS - {SCALE_PARAM}}
+
+        if scale != 1.0:
+            for name in self.px_params & params.keys():
+                params[name] = scale_px(params[name], scale)
+            if SCALE_PARAM in self.params:
+                params[SCALE_PARAM] = scale
+
+        return params
+
+def scale_px(value, scale):
+    # отрицательные значения (-1 = по центру) не масштабируются
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        return value
+    if isinstance(value, int):
+        return max(1, round(value * scale))
+    return value * scale
+
+_registry = {}
+_lock = threading.Lock()
+
+def _mod_path(mod_name):
+    if not mod_name or os.path.basename(mod_name) != mod_name:
+        raise FileNotFoundError(f"Модуль '{mod_name}' не найден")
+    return os.path.join(MODS_DIR, f"{mod_name}.py")
+
+def get_mod(mod_name):
+    mod_path = _mod_path(mod_name)
+
+    try:
+        mtime = os.stat(mod_path).st_mtime_ns
+    except FileNotFoundError:
+        with _lock:
+            _registry.pop(mod_name, None)
+        raise FileNotFoundError(f"Модуль '{mod_name}' не найден")
+
+    with _lock:
+        entry = _registry.get(mod_name)
+        if entry is None or entry.mtime != mtime:
+            spec = importlib.util.spec_from_file_location(mod_name, mod_path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+
+            entry = LoadedMod(mod_name, module, mtime)
+            _registry[mod_name] = entry
+
+    return entry
+
+def _mod_files():
+    return sorted(glob.glob(os.path.join(MODS_DIR, "*.py")))
+
 def get_mods():
     mod_list = []
+    names = set()
 
-    mod_files = glob.glob(os.path.join(MODS_DIR, "*.py"))
-
-    for mod_file in mod_files:
+    for mod_file in _mod_files():
+        mod_name = os.path.splitext(os.path.basename(mod_file))[0]
+        names.add(mod_name)
         try:
-            mod_name = os.path.splitext(os.path.basename(mod_file))[0]
-            spec = importlib.util.spec_from_file_location(mod_name, mod_file)
-            mod = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(mod)
+            entry = get_mod(mod_name)
 
-            if hasattr(mod, 'metadata'):
-                mod_list.append(mod.metadata)
+            if entry.metadata is not None:
+                mod_list.append(entry.metadata)
         except Exception as e:
             print(f"Ошибка загрузки мода {mod_name}: {e}")
 
+    with _lock:
+        for mod_name in set(_registry) - names:
+            del _registry[mod_name]
+
     return mod_list
 
-def apply_mods(image, mods_cfg):
-    cache = {}
+def get_mods_etag():
+    digest = hashlib.sha1()
+    for mod_file in _mod_files():
+        try:
+            digest.update(f"{os.path.basename(mod_file)}:{os.stat(mod_file).st_mtime_ns};".encode())
+        except FileNotFoundError:
+            continue
+    return digest.hexdigest()
 
-    for mod in mods_cfg:
-        mod_name = mod.get("name", "Нет названия")
-        mod_params = mod.get("params", {})
+def chain_keys(base_key, steps):
+    # ключ каждого префикса цепочки: исходник + все моды до него включительно
+    digest = hashlib.sha1(repr(base_key).encode())
+    keys = []
 
-        if mod_name not in cache:
-            mod_path = os.path.join(MODS_DIR, f"{mod_name}.py")
-            if not os.path.exists(mod_path):
-                raise FileNotFoundError(f"Модуль '{mod_name}' не найден")
-            
-            spec = importlib.util.spec_from_file_location(mod_name, mod_path)
-            mod_module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(mod_module)
-            cache[mod_name] = mod_module
-        else:
-            mod_module = cache[mod_name]
+    for entry, params in steps:
+        digest.update(json.dumps([entry.name, entry.mtime, params], sort_keys=True, default=str).encode())
+        if entry.random(params):
+            # случайный результат не должен браться из кеша: с этого шага ключи каждый раз новые
+            digest.update(uuid.uuid4().bytes)
+        keys.append(digest.hexdigest())
 
-        sig = inspect.signature(mod_module.apply)
-        allowed_params = sig.parameters.keys()
+    return keys
 
-        filtered_params = {k: v for k, v in mod_params.items() if k in allowed_params}
+def resolve_chain(mods_cfg, scale=1.0):
+    steps = []
+    for mod in mods_cfg or []:
+        entry = get_mod(mod.get("name", "Нет названия"))
+        steps.append((entry, entry.filter_params(mod.get("params", {}), scale)))
+    return steps
 
-        result_img = mod_module.apply(image, **filtered_params)
-        if not isinstance(result_img, Image.Image):
-            raise TypeError(f"Мод '{mod_name}' должен возвращать объект PIL.Image.Image")
+def resolve_react(mods_cfg, steps, scale=1.0):
+    # для каждого шага {параметр: (источник, amount, (min, max))} - параметры, которые двигает звук;
+    # в mods_cfg это "react": {"radius": {"source": "bass", "amount": 100}}
+    react = []
+    for mod, (entry, _) in zip(mods_cfg or [], steps):
+        bindings = {}
+        for name, cfg in (mod.get("react") or {}).items():
+            # звук двигает только слайдеры с "reactive" в metadata: у остальных значение может быть не числом
+            if name not in entry.params - TIME_PARAMS or not entry.sliders.get(name, {}).get("reactive") or not isinstance(cfg, dict):
+                continue
+
+            source, amount = cfg.get("source"), cfg.get("amount")
+            if not isinstance(source, str) or source not in reactive.SOURCES or isinstance(amount, bool) or not isinstance(amount, (int, float)) or not amount:
+                continue
+
+            slider = entry.sliders[name]
+            bounds = (slider.get("min"), slider.get("max"))
+            if name in entry.px_params:
+                # пределы слайдера заданы в пикселях полного размера, как и сам параметр
+                amount *= scale
+                bounds = tuple(None if bound is None else scale_px(bound, scale) for bound in bounds)
+            bindings[name] = (source, amount, bounds)
+        react.append(bindings)
+    return react
+
+def at_levels(steps, react, levels):
+    # шаги цепочки для кадра: levels - {источник: уровень 0..1}
+    return [
+        (entry, {
+            **params,
+            **{name: entry.react_value(name, params, amount, levels[source], bounds) for name, (source, amount, bounds) in bindings.items()}
+        })
+        for (entry, params), bindings in zip(steps, react)
+    ]
+
+def chain_random(steps, react):
+    # в цепочке есть шаг со случайным результатом (шум с зерном 0); параметры, которые двигает звук,
+    # проверяются на обоих краях уровня
+    return any(
+        entry.random(params)
+        for level in (0.0, 1.0)
+        for entry, params in at_levels(steps, react, dict.fromkeys(reactive.SOURCES, level))
+    )
+
+def chain_key(base_key, mods_cfg, scale=1.0):
+    keys = chain_keys(base_key, resolve_chain(mods_cfg, scale))
+    return keys[-1] if keys else base_key
+
+def first_animated(steps):
+    # индекс первого шага, который меняется во времени; все до него считается один раз
+    return next((i for i, (entry, params) in enumerate(steps) if entry.animated(params)), None)
+
+def at_time(steps, t, frame, period):
+    # шаги цепочки для кадра: анимированным модам добавляются t (секунды от начала петли), frame и period
+    values = {"t": t, "frame": frame, "period": period}
+    return [
+        (entry, {**params, **{k: values[k] for k in entry.time_params}} if entry.animated(params) else params)
+        for entry, params in steps
+    ]
+
+IDENTITY_LUT = list(range(256))
+
+def working_mode(steps, mode):
+    # RGBA держим всю цепочку, только если какой-то мод работает лишь в нем, а остальные его принимают
+    if steps and all(entry.modes for entry, _ in steps):
+        if any("RGB" not in entry.modes for entry, _ in steps) and all("RGBA" in entry.modes for entry, _ in steps):
+            return "RGBA"
+    return "RGBA" if mode == "RGBA" else "RGB"
+
+def input_mode(entry, mode, work, source_mode):
+    if entry.modes is None:
+        # моды без объявленных возможностей получают картинку как есть, но не навязанный цепочкой RGBA
+        return "RGB" if mode == "RGBA" and source_mode != "RGBA" else mode
+    if mode in entry.modes and (mode == work or work not in entry.modes):
+        return mode
+    return work if work in entry.modes else entry.modes[0]
+
+def plan_chain(steps):
+    # [(индекс последнего шага группы, шаги группы)]; подряд идущие LUT-моды - одна группа
+    plan = []
+    i = 0
+
+    while i < len(steps):
+        j = i + 1
+        if steps[i][0].lut:
+            while j < len(steps) and steps[j][0].lut:
+                j += 1
+
+        plan.append((j - 1, steps[i:j]))
+        i = j
+
+    return plan
+
+def apply_lut(image, steps):
+    table = IDENTITY_LUT
+    for entry, params in steps:
+        step_table = entry.lut(**params)
+        table = [step_table[v] for v in table]
+
+    # альфа-канал LUT-моды не трогают
+    if image.mode == "RGBA":
+        return image.point(table * 3 + IDENTITY_LUT)
+    return image.point(table * len(image.getbands()))
+
+def cached_prefix(image, keys):
+    # самый длинный закешированный префикс цепочки: (картинка, индекс первого невыполненного шага)
+    for i in range(len(keys or []) - 1, -1, -1):
+        cached = prefix_cache.get(keys[i])
+        if cached is not None:
+            return cached, i + 1
+    return image, 0
+
+def run_chain(image, steps, source_mode=None, on_result=None):
+    # on_result(индекс шага, картинка) вызывается после каждой группы плана
+    source_mode = source_mode or image.mode
+    work = working_mode(steps, image.mode)
+
+    for last, group in plan_chain(steps):
+        # превью, которое уже заменено более новым, дальше не считается
+        pool.check_cancelled()
+        entry, params = group[0]
+
+        mode = input_mode(entry, image.mode, work, source_mode)
+        if image.mode != mode:
+            image = image.convert(mode)
+
+        if entry.lut:
+            with metrics.timed("mod", "+".join(e.name for e, _ in group)):
+                result_img = apply_lut(image, group)
+        else:
+            # сохраненные картинки не должны меняться модами на месте
+            src = image.copy() if on_result else image
+            with metrics.timed("mod", entry.name):
+                result_img = entry.module.apply(src, **params)
+            if not isinstance(result_img, Image.Image):
+                raise TypeError(f"Мод '{entry.name}' должен возвращать объект PIL.Image.Image")
         image = result_img
 
-    return image
\ No newline at end of file
+        if on_result:
+            on_result(last, image)
+
+    # на выходе цепочки RGB, RGBA - только у исходника с прозрачностью; рабочий RGBA, L и прочие
+    # режимы, которые вернули моды, наружу не выходят
+    mode = "RGBA" if source_mode == "RGBA" else "RGB"
+    if image.mode != mode:
+        image = image.convert(mode)
+
+    return image
+
+def apply_mods(image, mods_cfg, scale=1.0, cache_key=None):
+    steps = resolve_chain(mods_cfg, scale)
+    source_mode = image.mode
+
+    if cache_key is None:
+        return run_chain(image, steps, source_mode)
+
+    keys = chain_keys(cache_key, steps)
+    image, start = cached_prefix(image, keys)
+
+    def store(i, result):
+        prefix_cache.put(keys[start + i], result)
+
+    return run_chain(image, steps[start:], source_mode, store)
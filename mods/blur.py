@@ -11,11 +11,17 @@ metadata = {
             "label": "Радиус",
             "min": 0,
             "max": 50,
-            "default": 0
+            "default": 0,
+            "unit": "px",
+            "reactive": True
         }
     ]
 }
 
+capabilities = {
+    "modes": ["RGB", "RGBA"]
+}
+
 def apply(image: Image.Image, radius = 10) -> Image.Image:
     return image.filter(
         ImageFilter.GaussianBlur(
@@ -1,3 +1,4 @@
+import numpy as np
 from PIL import Image, ImageEnhance
 
 metadata = {
@@ -12,11 +13,24 @@ metadata = {
             "min": 0,
             "max": 2,
             "default": 1,
-            "step": 0.01
+            "step": 0.01,
+            "reactive": True
         }
     ]
 }
 
+capabilities = {
+    "lut": True,
+    "modes": ["RGB", "RGBA"]
+}
+
+def lut(enhance: float = 1.0):
+    enhance = max(0.0, min(2.0, float(enhance)))
+
+    # как ImageEnhance.Brightness: смешивание с черным во float32 с отбрасыванием дробной части
+    values = np.float32(enhance) * np.arange(256, dtype=np.float32)
+    return np.clip(values, 0, 255).astype(np.uint8).tolist()
+
 def apply(image: Image.Image, enhance: float = 1.0) -> Image.Image:
     enhance = max(0.0, min(2.0, float(enhance)))
 
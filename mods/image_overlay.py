@@ -1,3 +1,4 @@
+import assets
 from PIL import Image
 
 metadata = {
@@ -6,32 +7,41 @@ metadata = {
     "description": "Наложение одного изображения на другое с возможностью настройки позиции и масштаба.",
     "params": [
         {"name": "overlay_path", "type": "file", "label": "Загрузить изображение", "accept": "image/*"},
-        {"name": "x", "type": "slider", "label": "X", "min": -1, "max": 1080, "default": -1},
-        {"name": "y", "type": "slider", "label": "Y", "min": -1, "max": 1080, "default": -1},
+        {"name": "x", "type": "slider", "label": "X", "min": -1, "max": 1080, "default": -1, "unit": "px"},
+        {"name": "y", "type": "slider", "label": "Y", "min": -1, "max": 1080, "default": -1, "unit": "px"},
         {"name": "scale", "type": "slider", "label": "Масштаб (%)", "min": 10, "max": 200, "default": 100}
     ]
 }
 
-def apply(image: Image.Image, overlay_path = "", x = -1, y = -1, scale = 100) -> Image.Image:
+capabilities = {
+    "modes": ["RGB", "RGBA"]
+}
+
+def split_overlay(overlay):
+    return overlay.convert("RGB"), overlay.getchannel("A")
+
+def apply(image: Image.Image, overlay_path = "", x = -1, y = -1, scale = 100, px_scale = 1.0) -> Image.Image:
     if not overlay_path:
         return image
 
     try:
-        overlay = Image.open(overlay_path).convert("RGBA")
+        # цвет и маска отдельно: так их и вставляем; кеш по файлу, его mtime и масштабу.
+        # scale - проценты от размера файла, в прокси-превью оверлей уменьшается вместе с картинкой
+        overlay, mask = assets.get(
+            ("image_overlay", scale, px_scale),
+            lambda: split_overlay(assets.image(overlay_path, "RGBA", scale=scale / 100 * px_scale)),
+            overlay_path
+        )
     except Exception as e:
         print(f"Ошибка загрузки оверлея: {e}")
         return image
 
-    scale_factor = scale / 100
-    new_width = int(overlay.width * scale_factor)
-    new_height = int(overlay.height * scale_factor)
-    overlay = overlay.resize((new_width, new_height), Image.LANCZOS)
-
-    base = image.convert("RGBA")
+    base = image.copy() if image.mode in ("RGB", "RGBA") else image.convert("RGB")
 
     pos_x = x if x >= 0 else (base.width - overlay.width) // 2
     pos_y = y if y >= 0 else (base.height - overlay.height) // 2
 
-    base.paste(overlay, (pos_x, pos_y), overlay)
+    # вставляем только цвет по маске, чтобы RGBA-основа оставалась непрозрачной
+    base.paste(overlay, (pos_x, pos_y), mask)
 
-    return base.convert("RGB")
\ No newline at end of file
+    return base
\ No newline at end of file
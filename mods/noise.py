@@ -1,4 +1,5 @@
 import random
+import numpy as np
 from PIL import Image
 
 metadata = {
@@ -12,8 +13,29 @@ metadata = {
             "label": "Интенсивность",
             "min": 0,
             "max": 100,
+            "default": 0,
+            "reactive": True
+        },
+        {
+            "name": "seed",
+            "type": "slider",
+            "label": "Зерно (0 - случайное)",
+            "min": 0,
+            "max": 9999,
             "default": 0
         },
+        {
+            "name": "mono",
+            "type": "checkbox",
+            "label": "Монохромный шум",
+            "default": False
+        },
+        {
+            "name": "animate",
+            "type": "checkbox",
+            "label": "Живое зерно (новый шум в каждом кадре)",
+            "default": False
+        },
         {
             "name": "regenerate_noise",
             "type": "button",
@@ -23,31 +45,49 @@ metadata = {
     ]
 }
 
-def apply(image: Image.Image, intensity: int = 0) -> Image.Image:
-    if image.mode != "RGB":
+capabilities = {
+    "modes": ["RGB", "RGBA"]
+}
+
+def is_animated(intensity=0, animate=False, **_):
+    return bool(animate) and intensity > 0
+
+def is_random(intensity=0, seed=0, **_):
+    return intensity > 0 and not int(seed)
+
+def apply(image: Image.Image, intensity: int = 0, seed: int = 0, mono: bool = False, animate: bool = False, frame: int = 0) -> Image.Image:
+    if image.mode not in ("RGB", "RGBA"):
         image = image.convert("RGB")
 
-    pixels = image.load()
-    width, height = image.size
+    factor = int(intensity / 100 * 64)
+    if factor <= 0:
+        return image
 
-    factor = intensity / 100 * 64
+    # с заданным зерном шум каждого кадра петли воспроизводим
+    if animate and int(seed):
+        rng = np.random.default_rng([int(seed), int(frame)])
+    else:
+        rng = np.random.default_rng(int(seed) or None)
+    channels = 1 if mono else 3
 
-    for y in range(height):
-        for x in range(width):
-            r, g, b = pixels[x, y]
-            r = min(255, max(0, r + random.randint(-int(factor), int(factor))))
-            g = min(255, max(0, g + random.randint(-int(factor), int(factor))))
-            b = min(255, max(0, b + random.randint(-int(factor), int(factor))))
-            pixels[x, y] = (r, g, b)
+    noise = rng.integers(-factor, factor + 1, size=(image.height, image.width, channels), dtype=np.int16)
+    pixels = np.asarray(image, dtype=np.int16)
+    pixels[..., :3] += noise
 
-    return image
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
 
 def on_button_click(button_name, params):
     if button_name == "regenerate_noise":
-        new_intensity = random.randint(10, 80)
+        new_seed = random.randint(1, 9999)
+        updates = {"seed": new_seed}
+
+        if not params.get("intensity"):
+            updates["intensity"] = random.randint(10, 80)
+
         return {
-            "message": f"Новый шум с интенсивностью {new_intensity} сгенерирован!",
-            "new_value": new_intensity,
-            "update_param": "intensity"
+            "message": f"Новый шум (зерно {new_seed}) сгенерирован!",
+            "new_value": new_seed,
+            "update_param": "seed",
+            "updates": updates
         }
-    return "Кнопка нажата"
\ No newline at end of file
+    return "Кнопка нажата"
@@ -1,3 +1,4 @@
+import math
 from PIL import Image
 
 metadata = {
@@ -12,9 +13,46 @@ metadata = {
             "min": -180,
             "max": 180,
             "default": 0
+        },
+        {
+            "name": "swing",
+            "type": "slider",
+            "label": "Покачивание (°)",
+            "min": 0,
+            "max": 30,
+            "step": 0.5,
+            "default": 0
         }
     ]
 }
 
-def apply(image: Image.Image, angle = 0) -> Image.Image:
-    return image.rotate(angle, expand=True)
\ No newline at end of file
+capabilities = {
+    "modes": ["RGB", "RGBA"]
+}
+
+def is_animated(swing=0, **_):
+    return swing != 0
+
+def expanded_size(size, angle):
+    w, h = size
+    a = math.radians(angle)
+    return (
+        math.ceil(abs(w * math.cos(a)) + abs(h * math.sin(a))),
+        math.ceil(abs(w * math.sin(a)) + abs(h * math.cos(a)))
+    )
+
+def apply(image: Image.Image, angle = 0, swing = 0, t = 0.0, period = 1.0) -> Image.Image:
+    # углы в RGBA заливаем непрозрачным черным, как в RGB
+    fillcolor = "black" if image.mode == "RGBA" else None
+    if not swing:
+        return image.rotate(angle, expand=True, fillcolor=fillcolor)
+
+    # покачивание вокруг angle: за период петли одно полное колебание;
+    # размер кадра постоянный - самый большой на всем размахе, иначе картинка дышала бы на холсте
+    sizes = [expanded_size(image.size, angle - swing + 2 * swing * i / 32) for i in range(33)]
+    size = (max(w for w, _ in sizes), max(h for _, h in sizes))
+
+    rotated = image.rotate(angle + swing * math.sin(2 * math.pi * t / period), expand=True, fillcolor=fillcolor)
+    canvas = Image.new(image.mode, size, "black")
+    canvas.paste(rotated, ((size[0] - rotated.width) // 2, (size[1] - rotated.height) // 2))
+    return canvas
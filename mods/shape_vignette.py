@@ -1,4 +1,5 @@
 import math
+import assets
 from PIL import Image, ImageDraw
 
 metadata = {
@@ -29,7 +30,9 @@ metadata = {
             "label": "Размер фигуры",
             "min": 10,
             "max": 500,
-            "default": 100
+            "default": 100,
+            "unit": "px",
+            "reactive": True
         },
         {
             "name": "opacity",
@@ -37,11 +40,24 @@ metadata = {
             "label": "Прозрачность фона",
             "min": 0,
             "max": 255,
-            "default": 128
+            "default": 128,
+            "reactive": True
+        },
+        {
+            "name": "pulse",
+            "type": "slider",
+            "label": "Пульсация (%)",
+            "min": 0,
+            "max": 50,
+            "default": 0
         }
     ]
 }
 
+capabilities = {
+    "modes": ["RGB", "RGBA"]
+}
+
 def regular_polygon(cx, cy, radius, sides):
     return [
         (
@@ -51,11 +67,14 @@ def regular_polygon(cx, cy, radius, sides):
         for i in range(sides)
     ]
 
-def apply(image: Image.Image, radius=100, opacity=128, shape="circle") -> Image.Image:
-    w, h = image.size
+def is_animated(pulse=0, **_):
+    return pulse > 0
+
+def build_mask(size, radius, opacity, shape):
+    w, h = size
     cx, cy = w // 2, h // 2
 
-    mask = Image.new("L", image.size, color=opacity)
+    mask = Image.new("L", size, color=opacity)
     draw = ImageDraw.Draw(mask)
 
     if shape == "circle":
@@ -108,6 +127,19 @@ def apply(image: Image.Image, radius=100, opacity=128, shape="circle") -> Image.
             path.append((cx + x * scale, cy - y * scale))
         draw.polygon(path, fill=0)
 
-    black_layer = Image.new("RGBA", image.size, (0, 0, 0, 255))
-    base = image.convert("RGBA")
+    return mask
+
+def apply(image: Image.Image, radius=100, opacity=128, shape="circle", pulse=0, t=0.0, period=1.0) -> Image.Image:
+    # пульсация: радиус плавно меняется на ±pulse% с периодом петли
+    if pulse:
+        radius = radius * (1 + pulse / 100 * math.sin(2 * math.pi * t / period))
+
+    # маска зависит только от размера и параметров фигуры - пересобирается, лишь когда они меняются
+    mask = assets.get(
+        ("shape_vignette", image.size, radius, opacity, shape),
+        lambda: build_mask(image.size, radius, opacity, shape)
+    )
+
+    base = image if image.mode in ("RGB", "RGBA") else image.convert("RGB")
+    black_layer = assets.solid(base.mode, image.size)
     return Image.composite(black_layer, base, mask)
\ No newline at end of file
@@ -16,8 +16,12 @@ metadata = {
     ]
 }
 
+capabilities = {
+    "modes": ["RGB", "RGBA"]
+}
+
 def apply(image: Image.Image, amount: int = 100) -> Image.Image:
-    if image.mode != "RGB":
+    if image.mode not in ("RGB", "RGBA"):
         image = image.convert("RGB")
 
     factor = amount / 100
@@ -1,4 +1,5 @@
 import os
+import assets
 from PIL import Image, ImageDraw, ImageFont
 
 metadata = {
@@ -7,15 +8,43 @@ metadata = {
     "description": "Наложение текста на изображение с возможностью настройки позиции и масштаба.",
     "params": [
         {"name": "text", "type": "text", "label": "Текст", "default": "Ваш текст здесь"},
-        {"name": "font_size", "type": "slider", "label": "Размер шрифта", "min": 10, "max": 130, "default": 70},
+        {"name": "font_size", "type": "slider", "label": "Размер шрифта", "min": 10, "max": 130, "default": 70, "unit": "px"},
         {"name": "color", "type": "color", "label": "Цвет", "default": "#FFFFFF"},
         {"name": "font_path", "type": "file", "label": "Загрузить шрифт", "accept": ".ttf, .otf, .woff, .woff2"},
-        {"name": "x", "type": "slider", "label": "X", "min": -1, "max": 1080, "default": -1},
-        {"name": "y", "type": "slider", "label": "Y", "min": -1, "max": 1080, "default": -1},
+        {"name": "x", "type": "slider", "label": "X", "min": -1, "max": 1080, "default": -1, "unit": "px"},
+        {"name": "y", "type": "slider", "label": "Y", "min": -1, "max": 1080, "default": -1, "unit": "px"},
         {"name": "scale", "type": "slider", "label": "Масштаб (%)", "min": 10, "max": 200, "default": 100}
     ]
 }
 
+capabilities = {
+    "modes": ["RGBA"]
+}
+
+def load_font(font_path, size):
+    try:
+        return assets.font(font_path, size)
+    except Exception as e:
+        print(f"Ошибка загрузки шрифта '{font_path}': {e}")
+        return ImageFont.load_default()
+
+def text_layer(size, text, font_path, font_size, color, x, y):
+    font_obj = load_font(font_path, font_size)
+
+    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+
+    text_bbox = draw.textbbox((0, 0), text, font=font_obj)
+    text_width = text_bbox[2] - text_bbox[0]
+    text_height = text_bbox[3] - text_bbox[1]
+
+    pos_x = x if x >= 0 else (size[0] - text_width) // 2
+    pos_y = y if y >= 0 else (size[1] - text_height) // 2
+
+    r, g, b = tuple(int(color.lstrip("#")[i:i+2], 16) for i in (0, 2, 4))
+    draw.text((pos_x, pos_y), text, font=font_obj, fill=(r, g, b, 255))
+    return overlay
+
 def apply(image: Image.Image, text="", font_size=70, color="#FFFFFF", font_path=None, x=-1, y=-1, scale=100) -> Image.Image:
     if not text:
         return image
@@ -26,24 +55,15 @@ def apply(image: Image.Image, text="", font_size=70, color="#FFFFFF", font_path=
         if not font_path:
             font_path = os.path.join(os.path.dirname(__file__), "arial.ttf")
 
-        try:
-            font_obj = ImageFont.truetype(font_path, size=scaled_font_size) if font_path else ImageFont.load_default()
-        except Exception as e:
-            print(f"Ошибка загрузки шрифта '{font_path}': {e}")
-            font_obj = ImageFont.load_default()
-
-        overlay = Image.new("RGBA", image.size, (0, 0, 0, 0))
-        draw = ImageDraw.Draw(overlay)
-
-        text_bbox = draw.textbbox((0, 0), text, font=font_obj)
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
-
-        pos_x = x if x >= 0 else (image.width - text_width) // 2
-        pos_y = y if y >= 0 else (image.height - text_height) // 2
+        # слой с текстом зависит только от размера картинки и параметров - строится один раз
+        overlay = assets.get(
+            ("text_overlay", image.size, text, scaled_font_size, color, x, y),
+            lambda: text_layer(image.size, text, font_path, scaled_font_size, color, x, y),
+            font_path if os.path.isfile(font_path) else None
+        )
 
-        r, g, b = tuple(int(color.lstrip("#")[i:i+2], 16) for i in (0, 2, 4))
-        draw.text((pos_x, pos_y), text, font=font_obj, fill=(r, g, b, 255))
+        if image.mode == "RGBA":
+            return Image.alpha_composite(image, overlay)
 
         combined = Image.alpha_composite(image.convert("RGBA"), overlay)
         return combined.convert("RGB")
@@ -0,0 +1,250 @@
+import os, threading, queue, pickle, time, metrics
+import multiprocessing
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from PIL import Image
+
+# 0 - считать в потоке запроса, без отдельных процессов
+PROCESSES = os.cpu_count() or 1
+TASK_TIMEOUT = 60
+# как часто ожидающий результата поток проверяет, не отменена ли задача
+CANCEL_POLL = 0.02
+
+class TaskTimeout(RuntimeError):
+    pass
+
+class Cancelled(RuntimeError):
+    pass
+
+class WorkerCrashed(RuntimeError):
+    pass
+
+class _Shared:
+    # описание картинки в общей памяти - по каналу передается только оно
+    def __init__(self, name, mode, size, palette=None):
+        self.name = name
+        self.mode = mode
+        self.size = size
+        self.palette = palette
+
+def _share(img, blocks):
+    data = img.tobytes()
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    block.buf[:len(data)] = data
+    blocks.append(block)
+
+    palette = img.getpalette() if img.mode in ("P", "PA") else None
+    return _Shared(block.name, img.mode, img.size, palette)
+
+def _attach(shared, unlink=False):
+    block = shared_memory.SharedMemory(name=shared.name)
+    try:
+        img = Image.frombuffer(shared.mode, shared.size, block.buf, "raw", shared.mode, 0, 1).copy()
+    finally:
+        block.close()
+        if unlink:
+            block.unlink()
+
+    if shared.palette:
+        img.putpalette(shared.palette)
+    return img
+
+def _pack(value, blocks):
+    if isinstance(value, Image.Image):
+        return _share(value, blocks)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_pack(v, blocks) for v in value)
+    if isinstance(value, dict):
+        return {k: _pack(v, blocks) for k, v in value.items()}
+    return value
+
+def _unpack(value, unlink=False):
+    if isinstance(value, _Shared):
+        return _attach(value, unlink)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unpack(v, unlink) for v in value)
+    if isinstance(value, dict):
+        return {k: _unpack(v, unlink) for k, v in value.items()}
+    return value
+
+def _error(e):
+    # исключение должно пережить передачу между процессами
+    try:
+        pickle.loads(pickle.dumps(e))
+        return e
+    except Exception:
+        return RuntimeError(str(e))
+
+# в процессе пула: флаг отмены текущей задачи, его ставит родитель
+_cancel = None
+
+def _worker(conn, cancel):
+    global _cancel
+    _cancel = cancel
+
+    while True:
+        try:
+            fn, args, kwargs = conn.recv()
+        except EOFError:
+            return
+
+        blocks = []
+        # замеры этапов уходят родителю вместе с результатом
+        with metrics.collect() as timings:
+            try:
+                message = ("ok", _pack(fn(*_unpack(args), **_unpack(kwargs)), blocks))
+            except Exception as e:
+                for block in blocks:
+                    block.close()
+                    block.unlink()
+                blocks = []
+                message = ("error", _error(e))
+        conn.send((*message, timings))
+
+        # блоки результата живут, пока родитель их не скопирует
+        try:
+            conn.recv()
+        except EOFError:
+            pass
+        finally:
+            for block in blocks:
+                block.close()
+
+class _Process:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.cancel = ctx.Event()
+        self.process = ctx.Process(target=_worker, args=(child, self.cancel), daemon=True, name="render-worker")
+        self.process.start()
+        child.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+_ctx = multiprocessing.get_context("spawn")
+_local = threading.local()
+_idle = queue.LifoQueue()
+_started = 0
+_lock = threading.Lock()
+
+def _acquire(timeout):
+    global _started
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            return _idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        # место освобождается и когда убивают зависший процесс - тогда запускаем новый
+        with _lock:
+            if _started < PROCESSES:
+                _started += 1
+                try:
+                    return _Process(_ctx)
+                except Exception:
+                    _started -= 1
+                    raise
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TaskTimeout("Все процессы рендера заняты, попробуйте позже")
+        check_cancelled()
+
+        try:
+            return _idle.get(timeout=min(remaining, 0.1))
+        except queue.Empty:
+            pass
+
+def _release(worker, healthy):
+    global _started
+
+    if healthy:
+        _idle.put(worker)
+        return
+
+    worker.kill()
+    with _lock:
+        _started -= 1
+
+@contextmanager
+def inline():
+    # задачи этого потока считаются в нем же - например, чтобы их видел профилировщик
+    previous = getattr(_local, "inline", False)
+    _local.inline = True
+    try:
+        yield
+    finally:
+        _local.inline = previous
+
+@contextmanager
+def cancellable(check):
+    # задачи этого потока прерываются между шагами рендера, как только check() вернет True
+    previous = getattr(_local, "cancelled", None)
+    _local.cancelled = check
+    try:
+        yield
+    finally:
+        _local.cancelled = previous
+
+def check_cancelled():
+    # вызывается между шагами рендера: бросает Cancelled, если результат уже не нужен
+    check = getattr(_local, "cancelled", None)
+    if (_cancel is not None and _cancel.is_set()) or (check and check()):
+        raise Cancelled("Рендер отменен")
+
+def _wait(worker, timeout):
+    # ждет ответа процесса; при отмене просит его остановиться на ближайшем шаге и ждет дальше
+    check = getattr(_local, "cancelled", None)
+    deadline = time.monotonic() + timeout
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if worker.conn.poll(min(remaining, CANCEL_POLL) if check else remaining):
+            return True
+        if check and not worker.cancel.is_set() and check():
+            worker.cancel.set()
+
+def run(fn, *args, timeout=None, **kwargs):
+    # fn должна быть функцией уровня модуля; картинки в аргументах и результате идут через общую память
+    check_cancelled()
+    if PROCESSES <= 0 or getattr(_local, "inline", False):
+        return fn(*args, **kwargs)
+
+    timeout = timeout or TASK_TIMEOUT
+    with metrics.timed("pool_wait"):
+        worker = _acquire(timeout)
+    blocks = []
+    healthy = False
+
+    try:
+        worker.cancel.clear()
+        worker.conn.send((fn, _pack(args, blocks), _pack(kwargs, blocks)))
+
+        # зависший мод не должен держать сервер: процесс убивается и заменяется новым
+        if not _wait(worker, timeout):
+            raise TaskTimeout(f"Рендер не уложился в {timeout} с")
+
+        status, payload, timings = worker.conn.recv()
+        metrics.merge(timings)
+        try:
+            result = _unpack(payload, unlink=True)
+        finally:
+            worker.conn.send(None)
+        healthy = True
+    except (EOFError, OSError) as e:
+        raise WorkerCrashed(f"Процесс рендера завершился аварийно: {e}")
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+        _release(worker, healthy)
+
+    if status == "error":
+        raise result
+    return result
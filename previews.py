@@ -0,0 +1,95 @@
+import json, threading, time, pool
+
+# канал без подключенного потока событий удаляется через столько секунд
+CHANNEL_TTL = 5 * 60
+# комментарий в поток раз в столько секунд: так замечаем закрытую вкладку
+KEEPALIVE = 15
+
+class Channel:
+    # превью одной вкладки: ждет только самый новый запрос, более старые отменяются
+    def __init__(self):
+        self.seq = 0
+        self.pending = None
+        self.frame = None
+        self.stream = 0
+        self.touched = time.monotonic()
+        self._cond = threading.Condition()
+
+    def submit(self, data):
+        with self._cond:
+            self.seq += 1
+            self.pending = (self.seq, data)
+            self.touched = time.monotonic()
+            self._cond.notify_all()
+            return self.seq
+
+    def superseded(self, seq):
+        return self.seq != seq
+
+    def connect(self):
+        # новое подключение (в том числе переподключение EventSource) вытесняет старое
+        with self._cond:
+            self.stream += 1
+            self.touched = time.monotonic()
+            self._cond.notify_all()
+            return self.stream
+
+    def take(self, stream, timeout):
+        # (подключение еще актуально, (seq, data) самого нового запроса или None - пора отправить keepalive)
+        with self._cond:
+            if self.pending is None and self.stream == stream:
+                self._cond.wait(timeout)
+            self.touched = time.monotonic()
+            if self.stream != stream:
+                return False, None
+            pending, self.pending = self.pending, None
+            return True, pending
+
+_channels = {}
+_lock = threading.Lock()
+
+def get(client):
+    now = time.monotonic()
+    with _lock:
+        for key, channel in list(_channels.items()):
+            if now - channel.touched > CHANNEL_TTL:
+                del _channels[key]
+
+        channel = _channels.get(client)
+        if channel is None:
+            channel = _channels[client] = Channel()
+        return channel
+
+def event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+def stream(channel, render):
+    # генератор событий SSE; render(data) -> dict кадра, рендер идет в потоке этого подключения
+    stream_id = channel.connect()
+    if channel.frame:
+        yield event("frame", channel.frame)
+
+    while True:
+        alive, pending = channel.take(stream_id, KEEPALIVE)
+        if not alive:
+            return
+        if pending is None:
+            yield ": keepalive\n\n"
+            continue
+
+        seq, data = pending
+        try:
+            with pool.cancellable(lambda: channel.superseded(seq)):
+                frame = render(data)
+        except pool.Cancelled:
+            continue
+        except Exception as e:
+            if not channel.superseded(seq):
+                yield event("render-error", {"seq": seq, "error": f"Ошибка генерации предпросмотра: {e}"})
+            continue
+
+        # пока рендерился кадр, мог прийти более новый запрос - тогда этот уже не нужен
+        if channel.superseded(seq):
+            continue
+        channel.frame = {"seq": seq, **frame}
+        yield event("frame", channel.frame)
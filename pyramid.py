@@ -0,0 +1,156 @@
+import os, json, math, threading, uuid, metrics, uploads
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+
+# уровни по меньшей стороне: proxy - для превью, work - для рендера; оригинал остается для всего, что крупнее
+LEVELS = {"proxy": 540, "work": 1080}
+# уровень не строится, если он меньше предыдущего меньше чем во столько раз
+MIN_REDUCTION = 1.5
+# меняется при изменении уровней, чтобы старые пирамиды перестроились
+VERSION = 1
+
+# одна сборка за раз: декодирование 8K-оригинала занимает сотни мегабайт
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pyramid")
+_pending = set()
+_pending_lock = threading.Lock()
+
+def manifest_path(store_path):
+    return f"{os.path.splitext(store_path)[0]}.pyramid.json"
+
+def level_path(store_path, name):
+    return f"{os.path.splitext(store_path)[0]}.pyramid.{name}.png"
+
+def stored(img_path):
+    # файл хранилища для пути из рабочей папки (имя - sha256 содержимого) или None
+    digest, ext = os.path.splitext(os.path.basename(img_path))
+    return uploads.lookup(digest, ext)
+
+def scaled_size(size, scale):
+    return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+
+def draft_for(img, scale):
+    # JPEG можно декодировать сразу в 1/2, 1/4, 1/8 размера
+    if img.format == "JPEG" and scale <= 0.5:
+        img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+
+def normalize(img):
+    # поворот из EXIF и RGB: дальше по конвейеру картинка всегда в таком виде
+    ImageOps.exif_transpose(img, in_place=True)
+    return img if img.mode == "RGB" else img.convert("RGB")
+
+def open_original(img_path, need=None):
+    # (картинка, размер оригинала); если нужно не больше половины, JPEG декодируется сразу уменьшенным
+    with Image.open(img_path) as img:
+        size = uploads.image_size(img)
+        if need:
+            draft_for(img, need(size))
+        img.load()
+        return normalize(img), size
+
+def build(store_path):
+    with metrics.timed("pyramid"):
+        with Image.open(store_path) as img:
+            size = uploads.image_size(img)
+
+            targets = []
+            current = min(size)
+            for name, side in sorted(LEVELS.items(), key=lambda item: -item[1]):
+                if current / side >= MIN_REDUCTION:
+                    targets.append((name, scaled_size(size, side / min(size))))
+                    current = side
+
+            if not targets:
+                image = None
+            else:
+                draft_for(img, targets[0][1][0] / size[0])
+                img.load()
+                image = normalize(img)
+
+        levels = {}
+        # каждый уровень уменьшается из предыдущего, а не из оригинала
+        for name, target in targets:
+            if image.size != target:
+                image = image.resize(target, Image.LANCZOS)
+            _write(level_path(store_path, name), lambda f: image.save(f, format="PNG", compress_level=1))
+            levels[name] = list(target)
+
+        stat = os.stat(store_path)
+        manifest = {
+            "version": VERSION,
+            "source": [stat.st_size, stat.st_mtime_ns],
+            "size": list(size),
+            "levels": levels
+        }
+        # манифест пишется последним: есть манифест - есть и все уровни
+        _write(manifest_path(store_path), lambda f: f.write(json.dumps(manifest).encode("utf-8")))
+
+def _write(path, save):
+    tmp_path = f"{path}_{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            save(f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _build(store_path):
+    try:
+        build(store_path)
+    except Exception as e:
+        # без пирамиды все читается из оригинала
+        print(f"Ошибка подготовки уровней {store_path}: {e}")
+    finally:
+        with _pending_lock:
+            _pending.discard(store_path)
+
+def schedule(img_path):
+    # сборка уровней в фоне после загрузки; повторный вызов для готовой пирамиды ничего не делает
+    store_path = stored(img_path)
+    if not store_path or load_manifest(img_path, store_path):
+        return
+
+    with _pending_lock:
+        if store_path in _pending:
+            return
+        _pending.add(store_path)
+    _executor.submit(_build, store_path)
+
+def load_manifest(img_path, store_path=None):
+    store_path = store_path or stored(img_path)
+    if not store_path:
+        return None
+
+    try:
+        with open(manifest_path(store_path), encoding="utf-8") as f:
+            manifest = json.load(f)
+        stat = os.stat(img_path)
+    except (OSError, ValueError):
+        return None
+
+    # копия вместо жесткой ссылки или подмененный файл: уровни к нему не относятся
+    if manifest.get("version") != VERSION or manifest["source"] != [stat.st_size, stat.st_mtime_ns]:
+        return None
+
+    manifest["store_path"] = store_path
+    return manifest
+
+def open_image(img_path, need):
+    # need(размер оригинала) -> нужный масштаб относительно оригинала.
+    # Возвращает (картинка RGB, размер оригинала): наименьший уровень пирамиды, которого хватает,
+    # или оригинал, если пирамиды нет или нужен масштаб крупнее уровней
+    manifest = load_manifest(img_path)
+    if manifest:
+        size = tuple(manifest["size"])
+        target = scaled_size(size, need(size))
+        for name, level in sorted(manifest["levels"].items(), key=lambda item: item[1][0]):
+            if level[0] >= target[0] and level[1] >= target[1]:
+                try:
+                    with Image.open(level_path(manifest["store_path"], name)) as img:
+                        img.load()
+                        return img, size
+                except OSError:
+                    # уровень вытеснен вместе с оригиналом между проверками
+                    break
+
+    return open_original(img_path, need)
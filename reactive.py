@@ -0,0 +1,164 @@
+import os, subprocess, threading, uuid, metrics
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from cache import KeyedLocks, file_hash
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# кривые лежат рядом с перекодированными дорожками, по хешу содержимого исходника
+CACHE_DIR = os.path.join(BASE_DIR, "cache", "audio")
+# меняется при изменении анализа, чтобы старые кривые не подхватились
+VERSION = 1
+
+SAMPLE_RATE = 22050
+HOP = 441
+# значений кривой в секунду
+ANALYSIS_FPS = SAMPLE_RATE / HOP
+N_FFT = 2048
+# окон за один проход FFT: столько PCM (~1.8 МБ) и спектров держится в памяти одновременно
+CHUNK_HOPS = 1024
+
+# источник: полоса частот в Гц; level - громкость по всему сигналу
+SOURCES = {
+    "level": None,
+    "bass": (20, 250),
+    "mid": (250, 4000),
+    "treble": (4000, 11025)
+}
+
+# уровень 0..1: ниже нижнего перцентиля - тишина, выше верхнего - пик трека
+LEVEL_PERCENTILES = (10, 98)
+# после пика уровень спадает плавно, за столько секунд в e раз
+RELEASE = 0.15
+
+_locks = KeyedLocks()
+
+def _band_weights():
+    freqs = np.fft.rfftfreq(N_FFT, 1 / SAMPLE_RATE)
+    return np.stack([
+        (freqs >= band[0]) & (freqs < band[1])
+        for band in SOURCES.values() if band
+    ], axis=1).astype(np.float32)
+
+def _analyze_chunk(buf, window, weights):
+    # энергия каждого окна: громкость и полосы спектра одним матричным умножением
+    frames = sliding_window_view(buf, N_FFT)[::HOP]
+    power = (frames ** 2).mean(axis=1, dtype=np.float32)
+
+    spectrum = np.abs(np.fft.rfft(frames * window, axis=1)).astype(np.float32) ** 2
+    return np.column_stack([power, spectrum @ weights])
+
+def analyze(aud_path, ffmpeg_path):
+    # PCM идет из ffmpeg кусками, целиком трек в памяти не бывает; результат - (окна, источники), энергия
+    process = subprocess.Popen([
+        ffmpeg_path, '-v', 'error',
+        '-i', aud_path,
+        '-map', '0:a:0',
+        '-ac', '1',
+        '-ar', str(SAMPLE_RATE),
+        '-f', 'f32le',
+        'pipe:1'
+    ], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+    reader.start()
+
+    window = np.hanning(N_FFT).astype(np.float32)
+    weights = _band_weights()
+    # окно k центрировано на отсчете k * HOP
+    tail = np.zeros(N_FFT // 2, np.float32)
+    results = []
+
+    try:
+        while True:
+            data = process.stdout.read(CHUNK_HOPS * HOP * 4)
+            if not data:
+                tail = np.concatenate([tail, np.zeros(N_FFT // 2, np.float32)])
+            else:
+                tail = np.concatenate([tail, np.frombuffer(data[:len(data) // 4 * 4], np.float32)])
+
+            count = (len(tail) - N_FFT) // HOP + 1
+            if count > 0:
+                results.append(_analyze_chunk(tail[:(count - 1) * HOP + N_FFT], window, weights))
+                tail = tail[count * HOP:]
+
+            if not data:
+                break
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        reader.join()
+
+    if process.returncode != 0:
+        error = b"".join(stderr).decode("utf-8", "replace") or "Неизвестная ошибка"
+        raise RuntimeError(f"ffmpeg error: {error}")
+
+    if not results:
+        return np.zeros((0, len(SOURCES)), np.float32)
+    return np.concatenate(results)
+
+def cache_path(aud_path):
+    return os.path.join(CACHE_DIR, f"{file_hash(aud_path)}.react{VERSION}.npy")
+
+def load_energy(aud_path, ffmpeg_path):
+    # анализ один раз на содержимое файла; повторные рендеры читают готовые кривые
+    path = cache_path(aud_path)
+
+    with _locks.hold(path):
+        if os.path.exists(path):
+            os.utime(path)
+            return np.load(path)
+
+        with metrics.timed("audio_analysis"):
+            energy = analyze(aud_path, ffmpeg_path)
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = os.path.join(CACHE_DIR, f"{os.path.basename(path)}_{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, energy)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return energy
+
+def normalize(energy):
+    # энергия -> уровень 0..1 относительно самого трека
+    db = 10 * np.log10(energy.astype(np.float64) + 1e-10)
+    if not len(db):
+        return db
+    lo, hi = np.percentile(db, LEVEL_PERCENTILES)
+    return np.clip((db - lo) / max(hi - lo, 1e-6), 0, 1)
+
+def release(level, fps):
+    # мгновенная атака и плавный спад: картинка вздрагивает в такт, а не мерцает
+    decay = np.exp(-1 / (RELEASE * fps))
+    out = np.empty_like(level)
+    prev = 0.0
+    for i, value in enumerate(level.tolist()):
+        prev = value if value > prev else prev * decay + value * (1 - decay)
+        out[i] = prev
+    return out
+
+def curves(aud_path, sources, fps, count, ffmpeg_path):
+    # {источник: уровни 0..1 для каждого из count кадров видео}
+    unknown = set(sources) - SOURCES.keys()
+    if unknown:
+        raise ValueError(f"Неизвестный источник звука: {', '.join(sorted(unknown))}")
+
+    energy = load_energy(aud_path, ffmpeg_path)
+    positions = np.arange(count) * (ANALYSIS_FPS / fps)
+    indexes = np.arange(len(energy))
+    names = list(SOURCES)
+
+    result = {}
+    for source in sources:
+        level = normalize(energy[:, names.index(source)])
+        level = np.interp(positions, indexes, level, right=0) if len(level) else np.zeros(count)
+        result[source] = release(level, fps).astype(np.float32)
+    return result
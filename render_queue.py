@@ -0,0 +1,220 @@
+import os, json, sqlite3, threading, time, uuid
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# очередь рендера в SQLite; воркеры на других машинах открывают этот же файл на общем диске
+QUEUE_PATH = os.environ.get("VIBEMAKER_QUEUE") or os.path.join(BASE_DIR, "cache", "queue.sqlite3")
+
+# задача принадлежит воркеру, пока он продлевает аренду; без продления ее забирает другой
+LEASE = 30
+HEARTBEAT = 2
+# после стольких попыток (падения, истекшие аренды) задача уходит в dead
+MAX_ATTEMPTS = 3
+# пауза перед повтором растет с номером попытки
+RETRY_DELAY = 10
+JOB_TTL = 60 * 60
+DEAD_TTL = 7 * 24 * 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    task TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    pins TEXT NOT NULL DEFAULT '[]',
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_token TEXT,
+    lease_until REAL,
+    worker TEXT,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    progress REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    timings TEXT NOT NULL DEFAULT '[]',
+    created REAL NOT NULL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at);
+"""
+
+_ready = set()
+_ready_lock = threading.Lock()
+
+def connect():
+    # отдельное соединение на каждую операцию: потоки и процессы не делят состояние sqlite3
+    path = QUEUE_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+
+    with _ready_lock:
+        if path not in _ready:
+            conn.executescript(_SCHEMA)
+            _ready.add(path)
+    return conn
+
+@contextmanager
+def transaction():
+    # BEGIN IMMEDIATE: два воркера не заберут одну задачу
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+def _job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["pins"] = json.loads(job["pins"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    job["timings"] = json.loads(job["timings"])
+    return job
+
+def _prune(conn, now):
+    conn.execute(
+        "DELETE FROM jobs WHERE (status IN ('done', 'error', 'cancelled') AND finished < ?) OR (status = 'dead' AND finished < ?)",
+        (now - JOB_TTL, now - DEAD_TTL)
+    )
+
+def enqueue(task, args, kwargs, pins=(), max_active=None):
+    # id задачи или None, если активных задач уже max_active
+    now = time.time()
+    job_id = uuid.uuid4().hex
+    payload = json.dumps({"args": list(args), "kwargs": kwargs})
+
+    with transaction() as conn:
+        _prune(conn, now)
+        if max_active is not None:
+            active = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+            if active >= max_active:
+                return None
+
+        conn.execute(
+            "INSERT INTO jobs (id, task, payload, pins, status, available_at, created) VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+            (job_id, task, payload, json.dumps(sorted(pins)), now, now)
+        )
+    return job_id
+
+def get(job_id):
+    conn = connect()
+    try:
+        return _job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+    finally:
+        conn.close()
+
+def request_cancel(job_id):
+    # задача в очереди отменяется сразу, идущую останавливает воркер при следующем продлении аренды
+    now = time.time()
+    with transaction() as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status = 'queued'",
+            (now, job_id)
+        )
+        if cursor.rowcount:
+            return True
+        cursor = conn.execute("UPDATE jobs SET cancel = 1 WHERE id = ? AND status = 'running'", (job_id,))
+        return cursor.rowcount > 0
+
+def _expire(conn, now):
+    # воркер пропал (упал, потерял сеть): его задача возвращается в очередь или уходит в dead
+    for row in conn.execute("SELECT id, attempts, cancel FROM jobs WHERE status = 'running' AND lease_until < ?", (now,)).fetchall():
+        if row["cancel"]:
+            conn.execute("UPDATE jobs SET status = 'cancelled', lease_token = NULL, finished = ? WHERE id = ?", (now, row["id"]))
+        elif row["attempts"] >= MAX_ATTEMPTS:
+            conn.execute(
+                "UPDATE jobs SET status = 'dead', lease_token = NULL, error = ?, finished = ? WHERE id = ?",
+                ("Воркер перестал отвечать", now, row["id"])
+            )
+        else:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', lease_token = NULL, available_at = ? WHERE id = ?",
+                (now + RETRY_DELAY * row["attempts"], row["id"])
+            )
+
+def claim(worker):
+    # самая старая готовая к запуску задача с арендой на LEASE секунд или None
+    now = time.time()
+    token = uuid.uuid4().hex
+
+    with transaction() as conn:
+        _expire(conn, now)
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE status = 'queued' AND available_at <= ? ORDER BY created LIMIT 1",
+            (now,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        conn.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_token = ?, lease_until = ?, worker = ? WHERE id = ?",
+            (token, now + LEASE, worker, row["id"])
+        )
+        return _job(conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+def heartbeat(job_id, token, progress, timings):
+    # продлевает аренду; (аренда еще наша, просили отменить)
+    with transaction() as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET lease_until = ?, progress = ?, timings = ? WHERE id = ? AND lease_token = ? AND status = 'running'",
+            (time.time() + LEASE, progress, json.dumps(timings), job_id, token)
+        )
+        if not cursor.rowcount:
+            return False, False
+        return True, bool(conn.execute("SELECT cancel FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+
+def finish(job_id, token, status, result=None, error=None, timings=()):
+    # результат записывается, только если аренда еще у этого воркера
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, progress = CASE WHEN ? = 'done' THEN 100 ELSE progress END, result = ?, error = ?, "
+            "timings = ?, lease_token = NULL, finished = ? WHERE id = ? AND lease_token = ?",
+            (status, status, json.dumps(result) if result is not None else None, error,
+             json.dumps(list(timings)), time.time(), job_id, token)
+        )
+
+def retry(job_id, token, error, timings=()):
+    # ошибка, которая может пройти при повторе: снова в очередь с паузой или в dead
+    now = time.time()
+    with transaction() as conn:
+        row = conn.execute("SELECT attempts FROM jobs WHERE id = ? AND lease_token = ?", (job_id, token)).fetchone()
+        if row is None:
+            return
+
+        if row["attempts"] >= MAX_ATTEMPTS:
+            conn.execute(
+                "UPDATE jobs SET status = 'dead', error = ?, timings = ?, lease_token = NULL, finished = ? WHERE id = ?",
+                (error, json.dumps(list(timings)), now, job_id)
+            )
+        else:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', error = ?, progress = 0, lease_token = NULL, available_at = ? WHERE id = ?",
+                (error, now + RETRY_DELAY * row["attempts"], job_id)
+            )
+
+def release(job_id, token):
+    # воркер останавливается: задача возвращается в очередь, попытка не считается
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = CASE WHEN cancel THEN 'cancelled' ELSE 'queued' END, attempts = attempts - 1, "
+            "progress = 0, lease_token = NULL, available_at = ?, finished = CASE WHEN cancel THEN ? END "
+            "WHERE id = ? AND lease_token = ?",
+            (time.time(), time.time(), job_id, token)
+        )
+
+def pinned():
+    conn = connect()
+    try:
+        rows = conn.execute("SELECT pins FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+    finally:
+        conn.close()
+    return {pin for row in rows for pin in json.loads(row["pins"])}
@@ -0,0 +1,216 @@
+import os, re, json, hashlib, shutil, threading, uuid, mod, uploads
+from cache import file_hash
+from jobs import JobCancelled
+from video_gen import generate_videos, get_encoder_profile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# готовые видео по отпечатку запроса; файлы в папке video - жесткие ссылки на них
+STORE_DIR = os.path.join(BASE_DIR, "cache", "renders")
+STORE_MAX_BYTES = 20 * 1024 * 1024 * 1024
+# меняется при изменении рендера, чтобы старые видео не подхватились
+VERSION = 1
+# как часто задача, которая ждет чужой рендер, обновляет прогресс и проверяет отмену
+WAIT_INTERVAL = 0.5
+
+_STORE_RE = re.compile(r"^[0-9a-f]{64}\.mp4$")
+
+class _Flight:
+    # рендер, который уже идет в другой задаче
+    def __init__(self, job):
+        self.job = job
+        self.done = threading.Event()
+        self.status = None
+        self.error = None
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+def store_path(fingerprint):
+    return os.path.join(STORE_DIR, f"{fingerprint}.mp4")
+
+def _param_value(value):
+    # файл в параметрах мода (картинка, шрифт) - по содержимому, а не по пути рабочей папки
+    if isinstance(value, str) and os.path.isfile(value):
+        return {"file": uploads.content_hash(value)}
+    return value
+
+def normalize_mods(mods_cfg):
+    # цепочка так, как ее видит рендер: параметры после фильтрации со значениями по умолчанию, код мода - по хешу
+    steps = mod.resolve_chain(mods_cfg)
+    react = mod.resolve_react(mods_cfg, steps)
+
+    return [
+        {
+            "name": entry.name,
+            "code": file_hash(entry.module.__file__),
+            "params": {
+                name: _param_value(value)
+                for name, value in {**entry.defaults, **params}.items() if name not in mod.TIME_PARAMS
+            },
+            "react": {name: list(binding) for name, binding in bindings.items()}
+        }
+        for (entry, params), bindings in zip(steps, react)
+    ]
+
+def is_random(mods_cfg):
+    steps = mod.resolve_chain(mods_cfg)
+    return mod.chain_random(steps, mod.resolve_react(mods_cfg, steps))
+
+def fingerprint(image_hash, audio_hash, target, res_type, mods, profile):
+    payload = {
+        "version": VERSION,
+        "image": image_hash,
+        "audio": audio_hash,
+        "video_type": target["video_type"],
+        "video_style": target["video_style"],
+        "style_resize": res_type,
+        "mods": mods,
+        "profile": profile,
+        "encoder": get_encoder_profile(profile)
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def _lookup(fingerprint):
+    path = store_path(fingerprint)
+    try:
+        # время доступа и изменения - для вытеснения
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+def _claim(fingerprints, job):
+    # (рендерит эта задача, {отпечаток: чужой рендер}); готовые в хранилище не попадают никуда
+    owned, waiting = [], {}
+    with _flights_lock:
+        for fp in fingerprints:
+            if fp in _flights:
+                waiting[fp] = _flights[fp]
+            elif not _lookup(fp):
+                _flights[fp] = _Flight(job)
+                owned.append(fp)
+    return owned, waiting
+
+def _finish(fingerprints, status, error=None):
+    with _flights_lock:
+        for fp in fingerprints:
+            flight = _flights.pop(fp)
+            flight.status, flight.error = status, error
+            flight.done.set()
+
+def _wait(flight, job):
+    while not flight.done.wait(WAIT_INTERVAL):
+        if job:
+            job.check_cancelled()
+            if flight.job:
+                job.set_progress(flight.job.progress)
+
+    if flight.status == "error":
+        raise RuntimeError(flight.error)
+    # "cancelled" - чужую задачу отменили, рендер нужно взять на себя
+    return flight.status == "done"
+
+def _render(fingerprints, pending, img_path, aud_path, res_type, mods_cfg, profile, job):
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp_paths = {fp: os.path.join(STORE_DIR, f"{fp}_{uuid.uuid4().hex}.tmp.mp4") for fp in fingerprints}
+
+    try:
+        generate_videos(
+            img_path, aud_path,
+            [{**pending[fp][0], "out_path": tmp_paths[fp]} for fp in fingerprints],
+            res_type, mods_cfg, profile, job
+        )
+        for fp in fingerprints:
+            os.replace(tmp_paths[fp], store_path(fp))
+    except JobCancelled:
+        _finish(fingerprints, "cancelled")
+        raise
+    except Exception as e:
+        _finish(fingerprints, "cancelled" if job and job.cancelled else "error", str(e))
+        raise
+    finally:
+        for path in tmp_paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+
+    _finish(fingerprints, "done")
+    evict_store(keep=[store_path(fp) for fp in fingerprints])
+
+def link_output(path, out_path):
+    # именованный файл - жесткая ссылка на видео из хранилища; старый файл с тем же именем заменяется
+    if os.path.exists(out_path) and os.path.samefile(path, out_path):
+        return
+
+    tmp_path = f"{out_path}_{uuid.uuid4().hex}.tmp"
+    try:
+        try:
+            os.link(path, tmp_path)
+        except OSError:
+            # другой диск или ФС без жестких ссылок
+            shutil.copy2(path, tmp_path)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def evict_store(keep=()):
+    # сначала видео, на которые не ссылается ни один файл в video, затем самые давние
+    entries = []
+    total = 0
+    for name in os.listdir(STORE_DIR):
+        path = os.path.join(STORE_DIR, name)
+        if not _STORE_RE.match(name):
+            continue
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        total += stat.st_size
+        if path not in keep:
+            entries.append((stat.st_nlink > 1, stat.st_mtime, stat.st_size, path))
+
+    for _, _, size, path in sorted(entries):
+        if total <= STORE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def generate(img_path, aud_path, targets, res_type="default", mods_cfg=None, profile="default", job=None):
+    # как generate_videos, но каждый формат хранится по отпечатку запроса: повторный запрос только
+    # создает ссылки, а одинаковые рендеры из разных задач идут один раз - вторая задача ждет первую
+    if is_random(mods_cfg):
+        # случайный результат не повторяется: хранилище и общий рендер для него не используются
+        return generate_videos(img_path, aud_path, targets, res_type, mods_cfg, profile, job)
+
+    image_hash = uploads.content_hash(img_path)
+    audio_hash = uploads.content_hash(aud_path)
+    mods = normalize_mods(mods_cfg)
+
+    # отпечаток -> форматы запроса с ним (один и тот же формат может быть запрошен дважды)
+    pending = {}
+    for target in targets:
+        fp = fingerprint(image_hash, audio_hash, target, res_type, mods, profile)
+        pending.setdefault(fp, []).append(target)
+    links = [(fp, target) for fp, group in pending.items() for target in group]
+
+    remaining = list(pending)
+    while remaining:
+        if job:
+            job.check_cancelled()
+
+        owned, waiting = _claim(remaining, job)
+        if owned:
+            _render(owned, pending, img_path, aud_path, res_type, mods_cfg, profile, job)
+        remaining = [fp for fp, flight in waiting.items() if not _wait(flight, job)]
+
+    for fp, target in links:
+        path = _lookup(fp)
+        if path is None:
+            raise RuntimeError("Видео удалено из хранилища до завершения задачи")
+        link_output(path, target["out_path"])
+
+    return [target["out_path"] for target in targets]
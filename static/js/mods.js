@@ -7,10 +7,7 @@ document.addEventListener("DOMContentLoaded", () => {
 });
 
 function loadMods() {
-    fetch("/mods", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-    })
+    fetch("/mods")
     .then(res => res.json())
     .then(data => {
         if (data.mods && data.mods.length > 0) {
@@ -76,7 +73,7 @@ function renderSelectedMods() {
         let paramsHTML = '';
         modConfig.params.forEach(param => {
             const currentValue = mod.params[param.name] || param.default;
-            paramsHTML += generateParamHTML(mod.name, param, currentValue);
+            paramsHTML += generateParamHTML(mod.name, param, currentValue, (mod.react || {})[param.name]);
         });
 
         modCard.innerHTML = `
@@ -94,7 +91,7 @@ function renderSelectedMods() {
         container.appendChild(modCard);
     });
 
-    container.querySelectorAll("input[type='text'], input[type='range']").forEach(input => {
+    container.querySelectorAll("input[type='text'], input[type='range']:not(.react-input)").forEach(input => {
         input.addEventListener("input", () => {
             updateModParams(input);
         });
@@ -116,12 +113,18 @@ function renderSelectedMods() {
         });
     });
 
-    container.querySelectorAll("select").forEach(select => {
+    container.querySelectorAll("select:not(.react-input)").forEach(select => {
         select.addEventListener("change", () => {
             updateModParams(select);
         });
     });
 
+    container.querySelectorAll(".react-input").forEach(input => {
+        input.addEventListener("change", () => {
+            updateModReact(input);
+        });
+    });
+
     container.querySelectorAll("input[type='range']").forEach(rangeInput => {
         const valueSpan = rangeInput.nextElementSibling;
         if (valueSpan && valueSpan.tagName === "SPAN") {
@@ -153,21 +156,12 @@ function renderSelectedMods() {
                 }
                 notify(data.message);
 
-                if (data.new_value !== undefined) {
-                    const paramToUpdate = data.update_param || paramName;
-
-                    selectedMods[modIndex].params[paramToUpdate] = data.new_value;
-
-                    const input = document.getElementById(`mod-${modName}-${paramToUpdate}`);
-                    if (input) {
-                        input.value = data.new_value;
-                        if (input.type === 'range') {
-                            const valueSpan = input.nextElementSibling;
-                            if (valueSpan && valueSpan.tagName === 'SPAN') {
-                                valueSpan.textContent = data.new_value;
-                            }
-                        }
-                    }
+                if (data.updates) {
+                    Object.entries(data.updates).forEach(([param, value]) => {
+                        setModParam(modIndex, modName, param, value);
+                    });
+                } else if (data.new_value !== undefined) {
+                    setModParam(modIndex, modName, data.update_param || paramName, data.new_value);
                 }
 
                 updatePreview();
@@ -223,7 +217,62 @@ function renderSelectedMods() {
     });
 }
 
-function generateParamHTML(modName, param, currentValue) {
+function setModParam(modIndex, modName, paramName, value) {
+    selectedMods[modIndex].params[paramName] = value;
+
+    const input = document.getElementById(`mod-${modName}-${paramName}`);
+    if (!input) return;
+
+    if (input.type === 'checkbox') {
+        input.checked = Boolean(value);
+        return;
+    }
+
+    input.value = value;
+    if (input.type === 'range') {
+        const valueSpan = input.nextElementSibling;
+        if (valueSpan && valueSpan.tagName === 'SPAN') {
+            valueSpan.textContent = value;
+        }
+    }
+}
+
+const REACT_SOURCES = [
+    { label: "Без реакции на звук", value: "" },
+    { label: "Громкость", value: "level" },
+    { label: "Бас", value: "bass" },
+    { label: "Середина", value: "mid" },
+    { label: "Верха", value: "treble" }
+];
+
+function generateReactHTML(modName, param, react) {
+    // параметр двигается звуком: значение = слайдер + сила * уровень (0..1)
+    const span = param.max - param.min;
+    const amount = react ? react.amount : span / 2;
+    const source = react ? react.source : "";
+    const step = param.step !== undefined ? `step="${param.step}"` : '';
+    const data = `data-mod="${modName}" data-param="${param.name}"`;
+
+    return `
+        <div class="mod-react">
+            <select id="react-${modName}-${param.name}-source" class="settings-input react-input" ${data}>
+                ${REACT_SOURCES.map(option => `
+                    <option value="${option.value}" ${option.value === source ? "selected" : ""}>
+                        ${option.label}
+                    </option>
+                `).join("")}
+            </select>
+            <input type="range" id="react-${modName}-${param.name}-amount"
+                   min="${-span}" max="${span}"
+                   value="${amount}"
+                   ${step}
+                   class="settings-range react-input" ${data}>
+            <span>${amount}</span>
+        </div>
+    `;
+}
+
+function generateParamHTML(modName, param, currentValue, react) {
     const paramId = `mod-${modName}-${param.name}`;
 
     if (param.type === "slider") {
@@ -237,6 +286,7 @@ function generateParamHTML(modName, param, currentValue) {
                        ${step}
                        class="settings-range">
                 <span>${currentValue}</span>
+                ${param.reactive ? generateReactHTML(modName, param, react) : ""}
             </div>
         `;
     } else if (param.type === "text") {
@@ -343,10 +393,27 @@ function updateModParams(input) {
     selectedMods[modIndex].params[paramName] = value;
 }
 
+function updateModReact(input) {
+    const { mod: modName, param: paramName } = input.dataset;
+    const mod = selectedMods.find(m => m.name === modName);
+    if (!mod) return;
+
+    const source = document.getElementById(`react-${modName}-${paramName}-source`).value;
+    const amount = parseFloat(document.getElementById(`react-${modName}-${paramName}-amount`).value);
+
+    mod.react = mod.react || {};
+    if (source) {
+        mod.react[paramName] = { source, amount };
+    } else {
+        delete mod.react[paramName];
+    }
+}
+
 function collectMods() {
     return selectedMods.map(mod => ({
         name: mod.name,
-        params: mod.params || {}
+        params: mod.params || {},
+        react: mod.react || {}
     }));
 }
 
@@ -386,7 +453,8 @@ function initModsUI() {
 
                 selectedMods.push({
                     name: mod.name,
-                    params: paramsToUse
+                    params: paramsToUse,
+                    react: oldMod ? oldMod.react || {} : {}
                 });
             }
         });
@@ -8,26 +8,70 @@ function $(id) {
     return document.getElementById(id);
 }
 
+// файлы больше этого размера не хешируются в браузере - они просто загружаются по частям
+const UPLOAD_HASH_LIMIT = 512 * 1024 * 1024;
+const UPLOAD_RETRIES = 5;
+
+async function hashFile(file) {
+    // по sha256 сервер узнает уже загруженный файл; crypto.subtle есть только на localhost и https
+    if (!window.crypto?.subtle || file.size > UPLOAD_HASH_LIMIT) return null;
+
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function uploadFile(file, type) {
+    const init = await fetch('/upload/init', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size, type, sha256: await hashFile(file) })
+    }).then(res => res.json());
+
+    if (init.error) throw new Error(init.error);
+    if (init.path) return init;
+
+    let offset = init.offset;
+    let retries = 0;
+
+    while (true) {
+        const chunk = file.slice(offset, offset + init.chunk_size);
+        let res, data;
+
+        try {
+            res = await fetch(`/upload/${init.upload_id}`, {
+                method: 'PUT',
+                headers: { 'Content-Range': `bytes ${offset}-${offset + chunk.size - 1}/${file.size}` },
+                body: chunk
+            });
+            data = await res.json();
+        } catch {
+            // обрыв связи: узнаем, сколько сервер успел получить, и продолжаем с этого места
+            if (++retries > UPLOAD_RETRIES) throw new Error('Ошибка загрузки');
+            await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+
+            const state = await fetch(`/upload/${init.upload_id}`).then(r => r.json()).catch(() => null);
+            if (state?.error) throw new Error(state.error);
+            if (state) offset = state.offset;
+            continue;
+        }
+
+        if (data.error && res.status !== 409) throw new Error(data.error);
+        if (data.path) return data;
+
+        offset = data.offset;
+        retries = 0;
+    }
+}
+
 function handleFileUpload(e, type, callback) {
     const file = e.target.files?.[0];
     if (!file) return;
 
-    const formData = new FormData();
-    formData.append('file', file);
-    formData.append('type', type);
-
     if (type === 'image') selectedImageFile = file;
     if (type === 'audio') selectedAudioFile = file;
 
-    fetch('/upload', { method: 'POST', body: formData })
-        .then(res => res.json())
+    uploadFile(file, type)
         .then(data => {
-            if (data.error) {
-                notify(data.error, 'error');
-                if (callback) callback(null, data.error);
-                return;
-            }
-
             if (callback) {
                 callback(data.path);
             }
@@ -46,42 +90,102 @@ function handleFileUpload(e, type, callback) {
                 }
             }
         })
-        .catch(() => {
-            notify(`Ошибка загрузки ${type}`, 'error');
-            if (callback) callback(null, 'Ошибка загрузки');
+        .catch(err => {
+            notify(err.message || `Ошибка загрузки ${type}`, 'error');
+            if (callback) callback(null, err.message || 'Ошибка загрузки');
         });
 }
 
+let previewUrl = null;
+
+function getPreviewSize() {
+    const rect = UI.preview.getBoundingClientRect();
+    const size = Math.max(rect.width, rect.height) * (window.devicePixelRatio || 1);
+    return Math.min(1920, Math.max(320, Math.ceil(size)));
+}
+
+// канал превью этой вкладки: запросы уходят в /preview/submit, готовые кадры приходят по SSE.
+// Сервер считает только последний запрос, поэтому перетаскивание слайдера не копит очередь рендеров
+const previewClient = window.crypto?.randomUUID?.() || `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+let previewStream = null;
+let previewSeq = 0;
+let shownSeq = 0;
+
+function showPreview(src) {
+    if (previewUrl) URL.revokeObjectURL(previewUrl);
+    previewUrl = src.startsWith('blob:') ? src : null;
+    UI.preview.innerHTML = `<img src="${src}" alt="Video Preview">`;
+}
+
+function showPreviewError(message) {
+    UI.preview.innerHTML = placeholder(message || 'Ошибка загрузки превью', 'exclamation-triangle');
+}
+
+function openPreviewStream() {
+    if (previewStream || !window.EventSource) return previewStream;
+
+    previewStream = new EventSource(`/preview/stream?client=${encodeURIComponent(previewClient)}`);
+    previewStream.addEventListener('frame', event => {
+        const data = JSON.parse(event.data);
+        if (data.seq <= shownSeq) return;
+        shownSeq = data.seq;
+        showPreview(data.preview);
+    });
+    previewStream.addEventListener('render-error', event => {
+        const data = JSON.parse(event.data);
+        if (data.seq === previewSeq) showPreviewError(data.error);
+    });
+    return previewStream;
+}
+
+function getPreviewRequest() {
+    return {
+        image_path: selectedImage,
+        video_type: UI.videoType.value,
+        style_resize: UI.styleResize.value,
+        video_style: UI.videoStyle.value,
+        max_size: getPreviewSize(),
+        format: 'jpeg',
+        mods: collectMods()
+    };
+}
+
 function updatePreview() {
     if (!selectedImage) {
         UI.preview.innerHTML = placeholder('Превью видео появится здесь', 'image');
         return;
     }
 
-    const mods = collectMods();
+    if (!openPreviewStream()) return requestPreviewImage();
 
-    fetch('/preview', {
+    fetch('/preview/submit', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-            image_path: selectedImage,
-            video_type: UI.videoType.value,
-            style_resize: UI.styleResize.value,
-            video_style: UI.videoStyle.value,
-            mods: mods
-        })
+        body: JSON.stringify({ ...getPreviewRequest(), client: previewClient })
     })
-        .then(res => res.json())
-        .then(data => {
-            UI.preview.innerHTML = data.error
-                ? placeholder(data.error, 'exclamation-triangle')
-                : `<img src="${data.preview}" alt="Video Preview">`;
-        })
-        .catch(() => {
-            UI.preview.innerHTML = placeholder('Ошибка загрузки превью', 'exclamation-triangle');
-        });
+        .then(res => res.json().then(data => {
+            if (!res.ok) throw new Error(data.error);
+            previewSeq = Math.max(previewSeq, data.seq);
+        }))
+        .catch(error => showPreviewError(error.message));
+}
+
+function requestPreviewImage() {
+    // без EventSource - обычный запрос на каждое изменение
+    fetch('/preview/image', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(getPreviewRequest())
+    })
+        .then(res => res.ok
+            ? res.blob()
+            : res.json().then(data => { throw new Error(data.error); }))
+        .then(blob => showPreview(URL.createObjectURL(blob)))
+        .catch(error => showPreviewError(error.message));
 }
 
+let currentJobId = null;
+
 function generateVideo() {
     if (!selectedImage || !selectedAudio || !UI.videoName.value.trim()) {
         return notify('Заполните все поля и загрузите файлы', 'error');
@@ -101,18 +205,77 @@ function generateVideo() {
             video_type: UI.videoType.value,
             style_resize: UI.styleResize.value,
             video_style: UI.videoStyle.value,
+            targets: UI.allFormats.checked
+                ? ['YouTube', 'TikTok', 'Instagram'].map(type => ({
+                    video_type: type,
+                    video_style: UI.videoStyle.value
+                }))
+                : null,
+            encoder_profile: UI.encoderProfile.value,
             save_folder: UI.folderPath?.value ?? 'output',
             mods: mods
         })
     })
     .then(res => res.json())
     .then(data => {
-        data.error
-            ? notify(data.error, 'error')
-            : (notify(data.message), setTimeout(() => location.reload(), 2000));
+        if (data.error) {
+            notify(data.error, 'error');
+            toggleGenerateBtn(false);
+            return;
+        }
+
+        notify(data.message, 'info');
+        currentJobId = data.job_id;
+        pollJob(data.job_id);
     })
-    .catch(() => notify('Ошибка генерации видео', 'error'))
-    .finally(() => toggleGenerateBtn(false));
+    .catch(() => {
+        notify('Ошибка генерации видео', 'error');
+        toggleGenerateBtn(false);
+    });
+}
+
+function pollJob(jobId) {
+    fetch(`/jobs/${jobId}`)
+        .then(res => res.json())
+        .then(job => {
+            if (job.error && !job.status) {
+                throw new Error(job.error);
+            }
+
+            if (job.status === 'queued' || job.status === 'running') {
+                toggleGenerateBtn(true, job.status === 'running' ? job.progress : null);
+                setTimeout(() => pollJob(jobId), 1000);
+                return;
+            }
+
+            currentJobId = null;
+            toggleGenerateBtn(false);
+
+            if (job.status === 'done') {
+                notify('Видео успешно сгенерировано!');
+                setTimeout(() => location.reload(), 2000);
+            } else if (job.status === 'cancelled') {
+                notify('Генерация отменена', 'info');
+            } else {
+                notify(`Ошибка генерации видео: ${job.error}`, 'error');
+            }
+        })
+        .catch(() => {
+            currentJobId = null;
+            toggleGenerateBtn(false);
+            notify('Ошибка генерации видео', 'error');
+        });
+}
+
+function cancelGeneration() {
+    if (!currentJobId) return;
+
+    fetch(`/jobs/${currentJobId}/cancel`, { method: 'POST' })
+        .then(res => res.json())
+        .then(data => {
+            if (data.error) notify(data.error, 'error');
+        })
+        .catch(() => notify('Не удалось отменить генерацию', 'error'));
 }
 
 function notify(msg, type = 'success') {
@@ -138,11 +301,12 @@ function placeholder(text, icon) {
     `;
 }
 
-function toggleGenerateBtn(loading) {
+function toggleGenerateBtn(loading, progress = null) {
     UI.generateBtn.disabled = loading;
     UI.generateBtn.innerHTML = loading
-        ? '<i class="fas fa-spinner fa-spin"></i> Генерация...'
+        ? `<i class="fas fa-spinner fa-spin"></i> Генерация...${progress !== null ? ` ${Math.round(progress)}%` : ''}`
         : '<i class="fas fa-play-circle"></i> Сгенерировать видео';
+    UI.cancelBtn.style.display = loading ? '' : 'none';
 }
 
 function downloadPreviewImage() {
@@ -200,6 +364,7 @@ function saveProject() {
             videoType: UI.videoType.value,
             styleResize: UI.styleResize.value,
             videoStyle: UI.videoStyle.value,
+            encoderProfile: UI.encoderProfile.value,
             videoName: UI.videoName.value,
             selectedMods: getSelectedModsData(),
         };
@@ -250,6 +415,7 @@ function loadProject(e) {
             UI.videoType.value = projectData.videoType;
             UI.styleResize.value = projectData.styleResize;
             UI.videoStyle.value = projectData.videoStyle;
+            UI.encoderProfile.value = projectData.encoderProfile || 'default';
             UI.videoName.value = projectData.videoName;
             
             loadSelectedMods(projectData.selectedMods);
@@ -326,7 +492,8 @@ function simulateFileUpload(file, type) {
 function getSelectedModsData() {
     return selectedMods.map(mod => ({
         name: mod.name,
-        params: mod.params || {}
+        params: mod.params || {},
+        react: mod.react || {}
     }));
 }
 
@@ -340,8 +507,11 @@ document.addEventListener('DOMContentLoaded', () => {
     UI.videoStyle = $('video-style');
     UI.styleResize = $('style-resize');
     UI.videoName = $('video-name');
+    UI.encoderProfile = $('encoder-profile');
+    UI.allFormats = $('all-formats');
     UI.folderPath = $('folder-path');
     UI.generateBtn = $('generate-btn');
+    UI.cancelBtn = $('cancel-btn');
     UI.preview = $('preview-container');
     UI.imageUploadBtn = $('select-image');
     UI.audioUploadBtn = $('select-audio');
@@ -397,6 +567,7 @@ document.addEventListener('DOMContentLoaded', () => {
     UI.audioUploadBtn.onclick = () => UI.audioInput.click();
 
     UI.generateBtn.onclick = generateVideo;
+    UI.cancelBtn.onclick = cancelGeneration;
     UI.downloadBtn.onclick = downloadPreviewImage;
 
     UI.imageInput.onchange = e => handleFileUpload(e, 'image');
@@ -1,8 +1,17 @@
-from PIL import Image, ImageEnhance, ImageFilter
+import metrics
+from PIL import Image, ImageEnhance, ImageFilter, ImageStat
+from cache import LRUCache
 
-def get_resized_size_and_offset(img: Image.Image, canvas_size):
+BLUR_RADIUS = 10
+BLUR_BRIGHTNESS = 0.7
+
+backgrounds = LRUCache("backgrounds", 64 * 1024 * 1024)
+
+def get_resized_size_and_offset(img, canvas_size):
+    # img - картинка или ее размер (ширина, высота)
     canvas_w, canvas_h = canvas_size
-    aspect_ratio = img.width / img.height
+    width, height = img.size if isinstance(img, Image.Image) else img
+    aspect_ratio = width / height
 
     if canvas_h >= canvas_w:
         new_w = canvas_w
@@ -18,20 +27,46 @@ def get_resized_size_and_offset(img: Image.Image, canvas_size):
     y_offset = (canvas_h - new_h) // 2
     return (new_w, new_h), (x_offset, y_offset)
 
-def create_blur_background(img: Image.Image, size):
-    bg_img = img.copy().resize(size, Image.LANCZOS)
-    bg_img = bg_img.filter(ImageFilter.GaussianBlur(radius=10))
-    bg_img = ImageEnhance.Brightness(bg_img).enhance(0.7)
-    return bg_img
+def create_blur_background(img: Image.Image, size, radius=BLUR_RADIUS, brightness=BLUR_BRIGHTNESS):
+    # при сильном размытии мелкие детали все равно теряются, поэтому размываем
+    # уменьшенную копию и растягиваем результат до размера холста
+    factor = max(1, min(8, int(radius // 3)))
+    small_size = (max(1, size[0] // factor), max(1, size[1] // factor))
+
+    bg_img = img.convert("RGB").resize(small_size, Image.BILINEAR, reducing_gap=2.0)
+    if radius:
+        bg_img = bg_img.filter(ImageFilter.GaussianBlur(radius=radius / factor))
+    bg_img = ImageEnhance.Brightness(bg_img).enhance(brightness)
+
+    return bg_img.resize(size, Image.BICUBIC)
+
+def get_average_color(img: Image.Image):
+    step = max(1, min(img.size) // 64)
+    small = img.reduce(step) if step > 1 else img
+    return tuple(round(c) for c in ImageStat.Stat(small.convert("RGB")).mean)
 
 def create_color_frame_background(img: Image.Image, size, color=None):
     if color is None:
-        img_thumb = img.copy()
-        img_thumb.thumbnail((1, 1))
-        color = img_thumb.getpixel((0, 0))
+        color = get_average_color(img)
     canvas = Image.new("RGB", size, color)
     return canvas
 
+def get_background(img: Image.Image, vid_style, size, cache_key=None):
+    # фон зависит только от исходника (после модов) и размера холста
+    key = (cache_key, vid_style, size) if cache_key is not None else None
+    bg_img = backgrounds.get(key) if key else None
+
+    if bg_img is None:
+        if vid_style == "blur":
+            bg_img = create_blur_background(img, size)
+        else:
+            bg_img = create_color_frame_background(img, size)
+
+        if key:
+            backgrounds.put(key, bg_img)
+
+    return bg_img.copy()
+
 def resize_and_center(img: Image.Image, canvas_size):
     (new_w, new_h), (x_offset, y_offset) = get_resized_size_and_offset(img, canvas_size)
     resized_img = img.resize((new_w, new_h), Image.LANCZOS)
@@ -39,29 +74,30 @@ def resize_and_center(img: Image.Image, canvas_size):
     canvas.paste(resized_img, (x_offset, y_offset))
     return canvas
 
-def apply_style(img: Image.Image, vid_type="YouTube", vid_style="black", prew_size=None):
+def get_canvas_size(vid_type="YouTube", scale=1.0):
+    match vid_type:
+        case "YouTube":
+            size = (1920, 1080)
+        case "TikTok":
+            size = (1080, 1920)
+        case _:
+            size = (1080, 1080)
+
+    if scale == 1.0:
+        return size
+    return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+
+def apply_style(img: Image.Image, vid_type="YouTube", vid_style="black", prew_size=None, cache_key=None):
     if prew_size is None:
-        match vid_type:
-            case "YouTube":
-                prew_size = (1920, 1080)
-            case "TikTok":
-                prew_size = (1080, 1920)
-            case _:
-                prew_size = (1080, 1080)
-
-    if vid_style == "blur":
-        bg_img = create_blur_background(img, prew_size)
-        (new_w, new_h), (x_offset, y_offset) = get_resized_size_and_offset(img, prew_size)
-        resized_img = img.resize((new_w, new_h), Image.LANCZOS)
-        bg_img.paste(resized_img, (x_offset, y_offset))
-        return bg_img
-
-    elif vid_style == "color":
-        bg_img = create_color_frame_background(img, prew_size)
-        (new_w, new_h), (x_offset, y_offset) = get_resized_size_and_offset(img, prew_size)
-        resized_img = img.resize((new_w, new_h), Image.LANCZOS)
-        bg_img.paste(resized_img, (x_offset, y_offset))
-        return bg_img
+        prew_size = get_canvas_size(vid_type)
 
-    else:
-        return resize_and_center(img, prew_size)
+    with metrics.timed("style", vid_style):
+        if vid_style in ("blur", "color"):
+            bg_img = get_background(img, vid_style, prew_size, cache_key)
+            (new_w, new_h), (x_offset, y_offset) = get_resized_size_and_offset(img, prew_size)
+            resized_img = img.resize((new_w, new_h), Image.LANCZOS)
+            bg_img.paste(resized_img, (x_offset, y_offset))
+            return bg_img
+
+        else:
+            return resize_and_center(img, prew_size)
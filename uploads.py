@@ -0,0 +1,263 @@
+import os, re, hashlib, shutil, threading, time, uuid
+from PIL import Image
+from cache import file_hash
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# загруженные файлы по sha256 содержимого; в рабочие папки попадают жесткие ссылки на них
+STORE_DIR = os.path.join(BASE_DIR, "cache", "uploads")
+STORE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+
+MAX_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024
+CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_TTL = 24 * 60 * 60
+MIN_IMAGE_HEIGHT = 1080
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+# EXIF Orientation 5-8: картинка хранится повернутой на 90°
+ORIENTATION_TAG = 0x0112
+
+class Upload:
+    def __init__(self, workspace, filename, size, kind, temp_dir):
+        self.id = uuid.uuid4().hex
+        self.workspace = workspace
+        self.filename = filename
+        self.ext = os.path.splitext(filename)[1].lower()
+        self.size = size
+        self.kind = kind
+        self.path = os.path.join(temp_dir, f"upload_{self.id}.part")
+        self.received = 0
+        self.image_size = None
+        self.created = time.time()
+        self._hash = hashlib.sha256()
+        self._lock = threading.Lock()
+
+    @property
+    def complete(self):
+        return self.received == self.size
+
+_uploads = {}
+_lock = threading.Lock()
+_store_lock = threading.Lock()
+
+def image_size(img):
+    # размер с учетом поворота из EXIF - так картинку покажет любой просмотрщик
+    w, h = img.size
+    if img.getexif().get(ORIENTATION_TAG) in (5, 6, 7, 8):
+        return h, w
+    return w, h
+
+def read_image_size(path):
+    # Image.open читает только заголовок, без декодирования пикселей
+    with Image.open(path) as img:
+        return image_size(img)
+
+def check_image(path):
+    _, h = read_image_size(path)
+    if h < MIN_IMAGE_HEIGHT:
+        raise ValueError(f"Высота изображения должна быть не менее {MIN_IMAGE_HEIGHT}px")
+
+def _copy_stream(stream, f, hasher, limit):
+    written = 0
+    while chunk := stream.read(1024 * 1024):
+        written += len(chunk)
+        if written > limit:
+            raise ValueError("Файл больше заявленного размера")
+        hasher.update(chunk)
+        f.write(chunk)
+    return written
+
+def save_stream(stream, temp_dir, ext):
+    # обычная загрузка одним запросом: пишем на диск и считаем хеш на лету
+    path = os.path.join(temp_dir, f"upload_{uuid.uuid4().hex}{ext}.part")
+    hasher = hashlib.sha256()
+    try:
+        with open(path, "wb") as f:
+            _copy_stream(stream, f, hasher, MAX_UPLOAD_SIZE)
+    except BaseException:
+        _discard(path)
+        raise
+    return path, hasher.hexdigest()
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def store_path(digest, ext):
+    return os.path.join(STORE_DIR, f"{digest}{ext}")
+
+def lookup(digest, ext):
+    if not isinstance(digest, str) or not _HASH_RE.match(digest):
+        return None
+
+    path = store_path(digest, ext)
+    if not os.path.exists(path):
+        return None
+
+    # время доступа - для вытеснения; mtime не трогаем, он входит в ключи кешей картинок
+    stat = os.stat(path)
+    os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+    return path
+
+def owned(digest, ext, dest_dir):
+    # файл с этим sha256, который рабочая папка уже загружала. Чужой файл из хранилища по одному хешу
+    # не выдается: хеш не доказывает, что у клиента есть сами данные, такой файл загружается заново
+    if not isinstance(digest, str) or not _HASH_RE.match(digest):
+        return None
+
+    path = os.path.join(dest_dir, f"{digest}{ext}")
+    if not os.path.isfile(path):
+        return None
+    lookup(digest, ext)
+    return path
+
+def content_hash(path):
+    # sha256 содержимого; у ссылки на файл хранилища он уже в имени, читать файл не нужно
+    digest, ext = os.path.splitext(os.path.basename(path))
+    if _HASH_RE.match(digest):
+        try:
+            if os.path.samefile(path, store_path(digest, ext)):
+                return digest
+        except OSError:
+            pass
+    return file_hash(path)
+
+def evict_store(keep=None):
+    # сначала файлы, на которые больше не ссылается ни одна рабочая папка, затем самые давние.
+    # Производные файлы (уровни картинки) начинаются с того же хеша и удаляются вместе с исходником
+    groups = {}
+    total = 0
+    for name in os.listdir(STORE_DIR):
+        path = os.path.join(STORE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        total += stat.st_size
+
+        group = groups.setdefault(name.split(".", 1)[0], [False, 0, 0, [], None])
+        group[2] += stat.st_size
+        group[3].append(path)
+        if _HASH_RE.match(os.path.splitext(name)[0]):
+            group[0], group[1], group[4] = stat.st_nlink > 1, stat.st_atime, path
+
+    entries = sorted(
+        (linked, atime, size, paths) for linked, atime, size, paths, source in groups.values()
+        if keep is None or source != keep
+    )
+    for _, _, size, paths in entries:
+        if total <= STORE_MAX_BYTES:
+            break
+        for path in paths:
+            _discard(path)
+        total -= size
+
+def ingest(part_path, digest, ext):
+    os.makedirs(STORE_DIR, exist_ok=True)
+    path = store_path(digest, ext)
+
+    with _store_lock:
+        if os.path.exists(path):
+            _discard(part_path)
+        else:
+            os.replace(part_path, path)
+            evict_store(keep=path)
+
+    return path
+
+def link_into(path, dest_dir):
+    dest = os.path.join(dest_dir, os.path.basename(path))
+    if not os.path.exists(dest):
+        try:
+            os.link(path, dest)
+        except OSError:
+            # другой диск или ФС без жестких ссылок
+            shutil.copy2(path, dest)
+    return dest
+
+def finish(part_path, digest, ext, kind, dest_dir):
+    # проверка, перенос в хранилище и ссылка в рабочую папку; возвращает путь в рабочей папке
+    try:
+        if kind == "image":
+            check_image(part_path)
+    except Exception:
+        _discard(part_path)
+        raise
+
+    return link_into(ingest(part_path, digest, ext), dest_dir)
+
+def _prune():
+    now = time.time()
+    for upload_id, upload in list(_uploads.items()):
+        if now - upload.created > UPLOAD_TTL:
+            del _uploads[upload_id]
+            _discard(upload.path)
+
+def start(workspace, filename, size, kind, temp_dir):
+    if not isinstance(size, int) or size <= 0:
+        raise ValueError("Файл пуст")
+    if size > MAX_UPLOAD_SIZE:
+        raise ValueError(f"Файл больше {MAX_UPLOAD_SIZE // (1024 * 1024)} МБ")
+
+    upload = Upload(workspace, filename, size, kind, temp_dir)
+    open(upload.path, "wb").close()
+
+    with _lock:
+        _prune()
+        _uploads[upload.id] = upload
+
+    return upload
+
+def get(upload_id, workspace):
+    with _lock:
+        upload = _uploads.get(upload_id)
+    return upload if upload and upload.workspace == workspace else None
+
+def cancel(upload):
+    with _lock:
+        _uploads.pop(upload.id, None)
+    _discard(upload.path)
+
+def write(upload, offset, stream):
+    # дописывает кусок с позиции offset; возвращает, сколько байт уже получено
+    with upload._lock:
+        if offset != upload.received:
+            return upload.received
+
+        try:
+            with open(upload.path, "ab") as f:
+                f.truncate(upload.received)
+                upload.received += _copy_stream(stream, f, upload._hash, upload.size - upload.received)
+        finally:
+            # при обрыве соединения в файле и хеше остается то, что успело прийти
+            if os.path.getsize(upload.path) != upload.received:
+                upload.received = os.path.getsize(upload.path)
+                upload._hash = _rehash(upload.path)
+
+        # размер картинки проверяем, как только дошел заголовок, чтобы не качать лишнее
+        if upload.kind == "image" and upload.image_size is None:
+            try:
+                upload.image_size = read_image_size(upload.path)
+            except Exception:
+                if upload.complete:
+                    cancel(upload)
+                    raise ValueError("Не удалось прочитать изображение")
+            if upload.image_size and upload.image_size[1] < MIN_IMAGE_HEIGHT:
+                cancel(upload)
+                raise ValueError(f"Высота изображения должна быть не менее {MIN_IMAGE_HEIGHT}px")
+
+        return upload.received
+
+def _rehash(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            hasher.update(chunk)
+    return hasher
+
+def complete(upload, dest_dir):
+    with _lock:
+        _uploads.pop(upload.id, None)
+    return finish(upload.path, upload._hash.hexdigest(), upload.ext, upload.kind, dest_dir)
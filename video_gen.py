@@ -1,116 +1,667 @@
-import os, subprocess, json, mod, uuid
-from PIL import Image, ImageFilter, ImageEnhance
-from style import apply_style
-from flask import current_app
+import os, io, subprocess, tempfile, mod, pool, pyramid, reactive, metrics, uuid, threading, math, hashlib, time
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from style import apply_style, get_canvas_size, get_resized_size_and_offset
+from flask import current_app, g
+from cache import LRUCache, KeyedLocks, sizeof, file_hash
+from audio import probe_audio
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 FFMPEG_PATH = os.path.join(BASE_DIR, "ffmpeg", "ffmpeg.exe")
-FFPROBE_PATH = os.path.join(BASE_DIR, "ffmpeg", "ffprobe.exe")
+
+source_cache = LRUCache("sources", 192 * 1024 * 1024, lambda v: sizeof(v[0]))
+frame_cache = LRUCache("frames", 64 * 1024 * 1024)
+# сырые кадры для параметров, которые двигает звук: (план, кадр петли, уровни) -> байты атласа
+reactive_cache = LRUCache("reactive_frames", 256 * 1024 * 1024)
+
+# закодированные AAC-дорожки по хешу содержимого исходника
+AUDIO_CACHE_DIR = os.path.join(BASE_DIR, "cache", "audio")
+AUDIO_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# дорожки, которые брали недавно, не вытесняются: их может сейчас мультиплексировать рендер этого или другого процесса
+AUDIO_CACHE_GRACE = 60 * 60
+
+_audio_locks = KeyedLocks()
+
+# fps: частота кадров входной картинки (None - по умолчанию ffmpeg, 25)
+# loop_segment: длина сегмента в секундах, который кодируется один раз
+# и затем повторяется через -stream_loop без перекодирования
+# animation_fps: частота кадров петли, если в цепочке есть анимированные моды
+ENCODER_PROFILES = {
+    "default": {
+        "fps": None,
+        "video": ['-c:v', 'libx264', '-b:v', '5M'],
+        "loop_segment": None,
+        "animation_fps": 25
+    },
+    "still": {
+        "fps": 1,
+        "video": [
+            '-c:v', 'libx264',
+            '-preset', 'medium',
+            '-tune', 'stillimage',
+            '-crf', '20',
+            '-g', '30'
+        ],
+        "loop_segment": 30,
+        "animation_fps": 12
+    }
+}
+
+# анимированные моды рендерятся петлей такой длины, которая повторяется на всю длину трека
+ANIMATION_PERIOD = 4
+# сколько памяти могут занимать кадры петли, которые уже считаются или ждут записи в ffmpeg
+ANIMATION_BUFFER_BYTES = 256 * 1024 * 1024
+# на сколько ступеней квантуется уровень звука: больше - плавнее, но больше уникальных кадров
+REACT_LEVELS = 24
+
+def get_encoder_profile(name="default"):
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"Неизвестный профиль кодирования: {name}")
+    return ENCODER_PROFILES[name]
+
+def crop_square(img, size=(1080, 1080)):
+    min_dim = min(img.size)
+    left = (img.width - min_dim) // 2
+    top = (img.height - min_dim) // 2
+    return img.crop(
+        (
+            left,
+            top,
+            left + min_dim,
+            top + min_dim
+        )
+    ).resize(size)
 
 def crop_and_resize(img_path, size=(1080, 1080)):
-    with Image.open(img_path) as img:
-        if img.height < 1080:
-            raise ValueError("Высота изображения должна быть не менее 1080px")
-        
-        min_dim = min(img.size)
-        left = (img.width - min_dim) // 2
-        top = (img.height - min_dim) // 2
-        img = img.crop(
-            (
-                left,
-                top,
-                left + min_dim,
-                top + min_dim
-            )
-        ).resize(size)
-
-        filename = os.path.splitext(os.path.basename(img_path))[0]
-        path = os.path.join(current_app.config["TEMP_FOLDER"], f"{filename}.jpg")
-        img.save(path)
-        return path
-    
+    img, original = pyramid.open_image(img_path, lambda s: size[0] / min(s))
+    if original[1] < 1080:
+        raise ValueError("Высота изображения должна быть не менее 1080px")
+
+    return crop_square(img, size), size[0] / 1080
+
+def fit_to_canvas(img_path, canvas_size=None):
+    # без холста - 1080 по меньшей стороне: этого хватает, чтобы вписать картинку в любой из форматов
+    def target(size):
+        if canvas_size is None:
+            return pyramid.scaled_size(size, pyramid.LEVELS["work"] / min(size))
+        return get_resized_size_and_offset(size, canvas_size)[0]
+
+    img, original = pyramid.open_image(img_path, lambda s: min(1.0, target(s)[0] / s[0]))
+    new_w, new_h = target(original)
+    if new_w >= original[0]:
+        return img, 1.0
+
+    if img.size != (new_w, new_h):
+        img = img.resize((max(1, new_w), max(1, new_h)))
+    return img, new_w / original[0]
+
 def crop_and_resize_for_style(img_path, style = "default", size=(1080, 1080)):
-    match style:
-        case "fullscreen":
-            return img_path
-        case _:
-            return crop_and_resize(img_path, size)
-    
-def get_audio_duration(path):
-    result = subprocess.run([
-        FFPROBE_PATH, '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'json', path
-    ], capture_output=True, text=True)
-
-    if result.returncode:
-        raise RuntimeError(f"ffprobe error: {result.stderr}")
-    
-    return float(
-        json.loads(result.stdout)['format']['duration']
-    )
+    key = (img_path, os.stat(img_path).st_mtime_ns, style, size)
+
+    cached = source_cache.get(key)
+    if cached is not None:
+        return cached
+
+    with metrics.timed("crop_and_resize", style):
+        match style:
+            case "fullscreen":
+                result = fit_to_canvas(img_path, size)
+            case _:
+                result = crop_and_resize(img_path, size)
+
+    source_cache.put(key, result)
+    return result
+
+def load_source(img_path, res_type="default", canvas_size=None, canvas_scale=1.0):
+    # canvas_scale < 1 - прокси-превью: весь конвейер идет в уменьшенном масштабе,
+    # пиксельные параметры модов масштабируются вместе с картинкой
+    if res_type == "fullscreen":
+        size = canvas_size if canvas_scale < 1.0 else None
+    else:
+        side = max(1, round(1080 * canvas_scale))
+        size = (side, side)
+
+    img, scale = crop_and_resize_for_style(img_path, res_type, size)
+    source_key = (img_path, os.stat(img_path).st_mtime_ns, res_type, img.size, scale)
+
+    return img, scale, source_key
+
+def render_task(image, source_mode, steps, formats, chain_key):
+    # выполняется в процессе пула: невыполненный остаток цепочки модов и стили для каждого формата
+    results = []
+    steps = [(mod.get_mod(name), params) for name, params in steps]
+    image = mod.run_chain(image, steps, source_mode, lambda i, result: results.append((i, result)))
+
+    frames = [
+        apply_style(image, vid_type, vid_style, canvas_size, cache_key=chain_key)
+        for vid_type, vid_style, canvas_size in formats
+    ]
+    return results, frames
+
+def render_styled(img_path, formats, res_type="default", mods_cfg=None, canvas_size=None, canvas_scale=1.0):
+    # formats: [(vid_type, vid_style, canvas_size)]; кеши проверяются здесь, работа уходит в пул процессов
+    img, scale, source_key = load_source(img_path, res_type, canvas_size, canvas_scale)
+
+    steps = mod.resolve_chain(mods_cfg, scale)
+    keys = mod.chain_keys(source_key, steps)
+    chain_key = keys[-1] if keys else source_key
 
-def create_blur_bg(img_path):
-    with Image.open(img_path) as img:
-        bg = img.resize(
-            (1920, 1080), Image.LANCZOS
-        ).filter(ImageFilter.GaussianBlur(20))
-        bg = ImageEnhance.Brightness(bg).enhance(0.7)
-
-        filename = os.path.splitext(os.path.basename(img_path))[0]
-        path = os.path.join(current_app.config["TEMP_FOLDER"], f"{filename}_bg.jpg")
-        bg.save(path)
-        return path
-    
-def generate_video(img_path, aud_path, out_path, vid_type = "YouTube", res_type = "default", vid_style = "black", mods_cfg = None):
-    main_img = crop_and_resize_for_style(img_path, res_type)
-    duration = get_audio_duration(aud_path)
-
-    with Image.open(main_img) as img:
-        if mods_cfg:
-            img = mod.apply_mods(img, mods_cfg)
-
-        img = apply_style(
-            img, vid_type, vid_style
+    frame_keys = [(chain_key, *fmt) for fmt in formats]
+    frames = [frame_cache.get(key) for key in frame_keys]
+    missing = [i for i, frame in enumerate(frames) if frame is None]
+
+    if missing:
+        image, start = mod.cached_prefix(img, keys)
+        results, rendered = pool.run(
+            render_task, image, img.mode,
+            [(entry.name, params) for entry, params in steps[start:]],
+            [formats[i] for i in missing], chain_key
+        )
+
+        for i, result in results:
+            mod.prefix_cache.put(keys[start + i], result)
+        for i, frame in zip(missing, rendered):
+            frame_cache.put(frame_keys[i], frame)
+            frames[i] = frame
+
+    return frames
+
+def animation_plan(img_path, targets, res_type="default", mods_cfg=None):
+    # None, если кадр не меняется во времени; иначе статическая часть цепочки уже посчитана,
+    # а остаток считается для каждого кадра: анимированные моды и параметры, которые двигает звук
+    img, scale, source_key = load_source(img_path, res_type)
+
+    steps = mod.resolve_chain(mods_cfg, scale)
+    react = mod.resolve_react(mods_cfg, steps, scale)
+    animated = mod.first_animated(steps)
+    reactive = next((i for i, bindings in enumerate(react) if bindings), None)
+    if animated is None and reactive is None:
+        return None
+
+    first = min(i for i in (animated, reactive) if i is not None)
+    keys = mod.chain_keys(source_key, steps)
+    image, start = mod.cached_prefix(img, keys[:first])
+    if start < first:
+        results, _ = pool.run(
+            render_task, image, img.mode,
+            [(entry.name, params) for entry, params in steps[start:first]],
+            [], None
         )
+        for i, result in results:
+            mod.prefix_cache.put(keys[start + i], result)
+        image = results[-1][1]
 
-        processed_path = os.path.join(current_app.config["TEMP_FOLDER"], f"processed_{uuid.uuid4().hex}.jpg")
-        img.save(processed_path, format="PNG")
-
-    match vid_type:
-        case "YouTube":
-            filter_complex = "[0:v]scale=1920:1080[v]"
-        case "TikTok":
-            filter_complex = "[0:v]scale=1080:1920[v]"
-        case _:
-            filter_complex = "[0:v]scale=1080:1080[v]"
-
-    cmd = [
-        FFMPEG_PATH,
-        '-loop', '1',
-        '-i', processed_path,
-        '-i', aud_path,
-        '-filter_complex', filter_complex,
-        '-map', '[v]',
-        '-map', '1:a',
-        '-t', str(duration),
-        '-c:v', 'libx264',
-        '-b:v', "5M",
-        '-c:a', 'aac',
-        '-pix_fmt', 'yuv420p',
-        '-shortest',
-        '-y',
-        out_path
+    formats = [
+        (target["video_type"], target["video_style"], get_canvas_size(target["video_type"]))
+        for target in targets
     ]
 
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    key = (keys[-1], repr(react), tuple(formats))
+    if mod.chain_random(steps, react):
+        # кадры со случайным шумом не должны повторяться в следующей генерации
+        key += (uuid.uuid4().hex,)
+
+    return {
+        "key": key,
+        "image": image,
+        "source_mode": img.mode,
+        "steps": steps[first:],
+        "react": react[first:],
+        "animated": animated is not None,
+        "formats": formats
+    }
+
+def render_animation_frame(image, source_mode, steps, formats, t, frame, period):
+    # выполняется в процессе пула: меняющийся во времени остаток цепочки и стили для одного кадра
+    steps = mod.at_time([(mod.get_mod(name), params) for name, params in steps], t, frame, period)
+    image = mod.run_chain(image, steps, source_mode)
+
+    atlas, _ = frame_atlas([
+        apply_style(image, vid_type, vid_style, canvas_size)
+        for vid_type, vid_style, canvas_size in formats
+    ])
+    return atlas
+
+def frame_buffer(plan, workers):
+    # сколько кадров может одновременно считаться и ждать записи в ffmpeg
+    width, height = atlas_size(atlas_regions([canvas_size for *_, canvas_size in plan["formats"]]))
+    return max(1, min(workers * 2, ANIMATION_BUFFER_BYTES // (width * height * 3)))
+
+def submit_frame(executor, plan, steps, fps, frame, period):
+    return executor.submit(
+        pool.run, render_animation_frame,
+        plan["image"], plan["source_mode"],
+        [(entry.name, params) for entry, params in steps], plan["formats"],
+        t=frame / fps, frame=frame, period=period
+    )
+
+def check_frame(plan, atlas):
+    frame_size = atlas_size(atlas_regions([canvas_size for *_, canvas_size in plan["formats"]]))
+    if atlas.size != frame_size:
+        raise RuntimeError(f"Кадр анимации {atlas.size} не совпадает с ожидаемым {frame_size}")
+    return atlas.tobytes()
+
+def animation_frames(plan, count, fps, job=None):
+    # сырые кадры петли по порядку; кадры считаются параллельно в пуле,
+    # но в работе и в очереди на запись не больше, чем помещается в ANIMATION_BUFFER_BYTES
+    workers = max(1, pool.PROCESSES)
+    buffer = frame_buffer(plan, workers)
+    period = count / fps
+
+    with ThreadPoolExecutor(max_workers=min(workers, buffer), thread_name_prefix="animation") as executor:
+        pending = deque()
+        submitted = 0
+
+        try:
+            while submitted < count or pending:
+                while submitted < count and len(pending) < buffer:
+                    pending.append(submit_frame(executor, plan, plan["steps"], fps, submitted, period))
+                    submitted += 1
+
+                atlas = pending.popleft().result()
+                if job:
+                    job.check_cancelled()
+                yield check_frame(plan, atlas)
+        finally:
+            for future in pending:
+                future.cancel()
+
+def reactive_frames(plan, levels, count, fps, loop=1, job=None):
+    # сырые кадры на всю длину трека; уровни звука квантуются, поэтому уникальных кадров немного:
+    # готовые берутся из reactive_cache, недостающие считаются в пуле с заглядыванием вперед
+    workers = max(1, pool.PROCESSES)
+    buffer = frame_buffer(plan, workers)
+    period = loop / fps
+    sources = list(levels)
+    quantized = np.stack([np.rint(levels[source] * (REACT_LEVELS - 1)) for source in sources], axis=1).astype(np.int16)
+
+    def frame_key(i):
+        return (plan["key"], i % loop, *quantized[i].tolist())
+
+    def render(key):
+        _, frame, *q = key
+        steps = mod.at_levels(plan["steps"], plan["react"], {
+            source: value / (REACT_LEVELS - 1) for source, value in zip(sources, q)
+        })
+        return submit_frame(executor, plan, steps, fps, frame, period)
+
+    with ThreadPoolExecutor(max_workers=min(workers, buffer), thread_name_prefix="reactive") as executor:
+        pending = deque()
+        rendering = {}
+        ahead = 0
+
+        try:
+            for i in range(count):
+                # заглядываем вперед, пока в работе не больше buffer кадров
+                while ahead < count and (ahead - i < buffer * 4) and len(rendering) < buffer:
+                    key = frame_key(ahead)
+                    if key not in rendering and reactive_cache.get(key) is None:
+                        rendering[key] = render(key)
+                    pending.append(key)
+                    ahead += 1
+
+                key = pending.popleft()
+                future = rendering.pop(key, None)
+                frame = reactive_cache.get(key)
+                if frame is None:
+                    frame = check_frame(plan, (future or render(key)).result())
+                    reactive_cache.put(key, frame)
+
+                if job:
+                    job.check_cancelled()
+                yield frame
+        finally:
+            for future in rendering.values():
+                future.cancel()
 
-    if os.path.exists(processed_path):
-        os.remove(processed_path)  
+def render_frame(img_path, vid_type="YouTube", res_type="default", vid_style="black", mods_cfg=None, max_size=None):
+    canvas_scale = min(1.0, max_size / max(get_canvas_size(vid_type))) if max_size else 1.0
+    canvas_size = get_canvas_size(vid_type, canvas_scale)
 
-    if result.returncode != 0:
-        error = result.stderr.decode("utf-8") if result.stderr else "Неизвестная ошибка"
+    return render_styled(img_path, [(vid_type, vid_style, canvas_size)], res_type, mods_cfg, canvas_size, canvas_scale)[0]
+
+def render_frames(img_path, targets, res_type="default", mods_cfg=None):
+    # обрезка и моды в полном размере не зависят от формата - считаем их один раз
+    formats = [
+        (target["video_type"], target["video_style"], get_canvas_size(target["video_type"]))
+        for target in targets
+    ]
+    return render_styled(img_path, formats, res_type, mods_cfg)
+
+def get_audio_duration(path):
+    return probe_audio(path)["duration"]
+
+def audio_codec_args(info):
+    # AAC: ~96 кбит/с на канал, многоканальное сводится в стерео
+    channels = min(info.get("channels") or 2, 2)
+    args = ['-c:a', 'aac', '-b:a', f"{96 * channels}k"]
+
+    if (info.get("channels") or 0) > 2:
+        args += ['-ac', '2']
+    if (info.get("sample_rate") or 0) > 48000:
+        args += ['-ar', '48000']
+
+    return args
+
+def run_ffmpeg(cmd, duration=None, job=None, input=None, stage="encode"):
+    # input - байты или итератор кусков для stdin (сырые кадры); пишутся из отдельного потока, пока читается прогресс
+    # stage - имя прохода в метриках
+    start = time.perf_counter()
+    progress = {}
+    cmd = [cmd[0], '-progress', 'pipe:1', '-nostats', *cmd[1:]]
+    process = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL
+    )
+    stdout = io.TextIOWrapper(process.stdout, encoding="utf-8", errors="replace")
+    stderr = io.TextIOWrapper(process.stderr, encoding="utf-8", errors="replace")
+
+    stderr_tail = deque(maxlen=40)
+    input_errors = []
+    threads = [threading.Thread(target=stderr_tail.extend, args=(stderr,), daemon=True)]
+    if input is not None:
+        threads.append(threading.Thread(target=feed_stdin, args=(process.stdin, input, input_errors), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    if job:
+        job.attach(process)
+
+    try:
+        for line in stdout:
+            key, _, value = line.strip().partition("=")
+            # out_time_ms у ffmpeg тоже в микросекундах
+            if job and duration and key in ("out_time_us", "out_time_ms") and value.isdigit():
+                job.set_progress(int(value) / 1_000_000 / duration * 100)
+            elif key in ("frame", "fps", "speed"):
+                try:
+                    progress[key] = float(value.rstrip("x"))
+                except ValueError:
+                    pass
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        for thread in threads:
+            thread.join()
+        if job:
+            job.detach()
+        record_ffmpeg(stage, time.perf_counter() - start, progress if process.returncode == 0 else {})
+
+    if job:
+        job.check_cancelled()
+
+    # ошибка при подготовке кадров: ffmpeg мог успешно закодировать то, что успело прийти
+    if input_errors:
+        raise input_errors[0]
+
+    if process.returncode != 0:
+        error = "".join(stderr_tail) or "Неизвестная ошибка"
         raise RuntimeError(f"ffmpeg error: {error}")
-    
-    return out_path
\ No newline at end of file
+
+def record_ffmpeg(stage, seconds, progress):
+    # итоговые fps и speed из -progress: сколько кадров в секунду и во сколько раз быстрее реального времени
+    fps, speed = progress.get("fps"), progress.get("speed")
+    # на коротких проходах ffmpeg пишет fps=0, тогда считаем по числу кадров
+    if not fps and progress.get("frame") and seconds > 0:
+        fps = round(progress["frame"] / seconds, 2)
+    if fps:
+        metrics.observe("vibemaker_ffmpeg_fps", fps, stage=stage)
+    if speed:
+        metrics.observe("vibemaker_ffmpeg_speed", speed, stage=stage)
+
+    desc = " ".join(part for part in (fps and f"fps={fps:g}", speed and f"speed={speed:g}x") if part)
+    metrics.record("ffmpeg", seconds, stage, desc or None)
+
+def feed_stdin(pipe, data, errors):
+    chunks = [data] if isinstance(data, (bytes, bytearray, memoryview)) else data
+    try:
+        for chunk in chunks:
+            try:
+                pipe.write(chunk)
+            except (BrokenPipeError, OSError):
+                # ffmpeg завершился раньше - причина будет в stderr
+                break
+    except Exception as e:
+        errors.append(e)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+        try:
+            pipe.close()
+        except OSError:
+            pass
+
+def render_temp_dir():
+    # у задачи своя временная папка в рабочей папке сессии; удаляется целиком при любом исходе
+    folder = g.get("temp_dir") or current_app.config["TEMP_FOLDER"]
+    os.makedirs(folder, exist_ok=True)
+    return tempfile.TemporaryDirectory(prefix="render_", dir=folder, ignore_cleanup_errors=True)
+
+def atlas_regions(sizes):
+    # (w, h, x, y) кадра каждого формата в атласе: друг под другом
+    regions = []
+    y = 0
+    for w, h in sizes:
+        regions.append((w, h, 0, y))
+        y += h
+    return regions
+
+def atlas_size(regions):
+    return max(w for w, _, _, _ in regions), sum(h for _, h, _, _ in regions)
+
+def frame_atlas(frames):
+    # кадры всех форматов одной картинкой друг под другом: в stdin ffmpeg один сырой кадр
+    regions = atlas_regions([frame.size for frame in frames])
+    atlas = Image.new("RGB", atlas_size(regions))
+
+    for frame, (_, _, x, y) in zip(frames, regions):
+        atlas.paste(frame.convert("RGB"), (x, y))
+
+    return atlas, regions
+
+def atlas_filters(regions, atlas_index=0, loop=True):
+    # в yuv420p переводим один раз, потом loop повторяет уже готовый кадр;
+    # у анимации каждый кадр свой, loop не нужен
+    chain = f"[{atlas_index}:v]format=yuv420p"
+    if loop:
+        chain += ",loop=loop=-1:size=1:start=0"
+    if len(regions) == 1:
+        return [f"{chain}[v0]"]
+
+    filters = [chain + f",split={len(regions)}" + "".join(f"[s{i}]" for i in range(len(regions)))]
+    for i, (w, h, x, y) in enumerate(regions):
+        filters.append(f"[s{i}]crop={w}:{h}:{x}:{y}[v{i}]")
+    return filters
+
+def evict_audio_cache(keep=None):
+    entries = []
+    total = 0
+    recent = time.time() - AUDIO_CACHE_GRACE
+    for name in os.listdir(AUDIO_CACHE_DIR):
+        path = os.path.join(AUDIO_CACHE_DIR, name)
+        if not name.endswith((".m4a", ".npy")):
+            continue
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        total += stat.st_size
+        if path != keep and stat.st_mtime < recent:
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    for _, size, path in sorted(entries):
+        if total <= AUDIO_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def prepare_audio(aud_path, audio_info, job=None):
+    # AAC уже подходит для mp4 - берем дорожку как есть
+    if audio_info.get("codec") == "aac":
+        return aud_path
+
+    args = audio_codec_args(audio_info)
+    key = hashlib.sha1(f"{file_hash(aud_path)}:{' '.join(args)}".encode()).hexdigest()
+    out_path = os.path.join(AUDIO_CACHE_DIR, f"{key}.m4a")
+
+    with _audio_locks.hold(key):
+        if os.path.exists(out_path):
+            os.utime(out_path)
+            return out_path
+
+        os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
+        tmp_path = os.path.join(AUDIO_CACHE_DIR, f"{key}_{uuid.uuid4().hex}.tmp")
+
+        try:
+            run_ffmpeg([
+                FFMPEG_PATH,
+                '-i', aud_path,
+                '-map', '0:a:0',
+                '-vn',
+                *args,
+                '-f', 'mp4',
+                '-y',
+                tmp_path
+            ], job=job, stage="audio")
+            os.replace(tmp_path, out_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    evict_audio_cache(keep=out_path)
+    return out_path
+
+def generate_video(img_path, aud_path, out_path, vid_type = "YouTube", res_type = "default", vid_style = "black", mods_cfg = None, profile = "default", job = None):
+    target = {"video_type": vid_type, "video_style": vid_style, "out_path": out_path}
+    return generate_videos(img_path, aud_path, [target], res_type, mods_cfg, profile, job)[0]
+
+def generate_videos(img_path, aud_path, targets, res_type = "default", mods_cfg = None, profile = "default", job = None):
+    # targets: [{"video_type", "video_style", "out_path"}] - все форматы
+    # рендерятся одним вызовом ffmpeg с общей аудиодорожкой без перекодирования
+    encoder = get_encoder_profile(profile)
+    audio_info = probe_audio(aud_path)
+    duration = audio_info["duration"]
+
+    if job:
+        job.check_cancelled()
+
+    plan = animation_plan(img_path, targets, res_type, mods_cfg)
+    if plan and any(plan["react"]):
+        # параметры от звука: кадры на всю длину трека, петля анимированных модов - внутри них
+        fps = encoder['animation_fps']
+        count = math.ceil(duration * fps)
+        loop = max(1, round(ANIMATION_PERIOD * fps)) if plan["animated"] else 1
+        sources = {source for bindings in plan["react"] for source, *_ in bindings.values()}
+        levels = reactive.curves(aud_path, sources, fps, count, FFMPEG_PATH)
+
+        regions = atlas_regions([canvas_size for *_, canvas_size in plan["formats"]])
+        frame_data = reactive_frames(plan, levels, count, fps, loop, job)
+        filters = atlas_filters(regions, loop=False)
+        segment_length = None
+    elif plan:
+        # анимация: короткая петля из уникальных кадров кодируется один раз и повторяется на весь трек
+        fps = encoder['animation_fps']
+        count = max(1, round(ANIMATION_PERIOD * fps))
+        regions = atlas_regions([canvas_size for *_, canvas_size in plan["formats"]])
+        frame_data = animation_frames(plan, count, fps, job)
+        filters = atlas_filters(regions, loop=False)
+        segment_length = ['-frames:v', str(count)]
+    else:
+        fps = encoder['fps'] or 25
+        with metrics.timed("frames"):
+            atlas, regions = frame_atlas(render_frames(img_path, targets, res_type, mods_cfg))
+        frame_data = atlas.tobytes()
+        filters = atlas_filters(regions)
+        segment_length = ['-t', str(min(encoder['loop_segment'], duration))] if encoder['loop_segment'] else None
+        del atlas
+
+    width, height = atlas_size(regions)
+    frame_input = [
+        '-f', 'rawvideo',
+        '-pix_fmt', 'rgb24',
+        '-video_size', f"{width}x{height}",
+        '-framerate', str(fps),
+        '-i', 'pipe:0'
+    ]
+
+    try:
+        with render_temp_dir() as tmp:
+            if job:
+                job.check_cancelled()
+
+            audio_path = prepare_audio(aud_path, audio_info, job)
+
+            if segment_length:
+                segment_paths = [os.path.join(tmp, f"segment_{i}.mp4") for i in range(len(targets))]
+
+                segment_outputs = []
+                for i, segment_path in enumerate(segment_paths):
+                    segment_outputs += [
+                        '-map', f"[v{i}]",
+                        *segment_length,
+                        *encoder['video'],
+                        '-pix_fmt', 'yuv420p',
+                        '-an',
+                        '-y',
+                        segment_path
+                    ]
+
+                run_ffmpeg([
+                    FFMPEG_PATH,
+                    *frame_input,
+                    '-filter_complex', ";".join(filters),
+                    *segment_outputs
+                ], job=job, input=frame_data, stage="segments")
+
+                inputs = []
+                for segment_path in segment_paths:
+                    inputs += ['-stream_loop', '-1', '-i', segment_path]
+                audio_index = len(targets)
+                video_maps = [f"{i}:v" for i in range(len(targets))]
+                video_args = ['-c:v', 'copy']
+                filter_args = []
+                stdin = None
+            else:
+                inputs = frame_input
+                audio_index = 1
+                video_maps = [f"[v{i}]" for i in range(len(targets))]
+                video_args = [*encoder['video'], '-pix_fmt', 'yuv420p']
+                filter_args = ['-filter_complex', ";".join(filters)]
+                stdin = frame_data
+
+            outputs = []
+            for target, video_map in zip(targets, video_maps):
+                outputs += [
+                    '-map', video_map,
+                    '-map', f"{audio_index}:a:0",
+                    '-t', str(duration),
+                    *video_args,
+                    '-c:a', 'copy',
+                    '-shortest',
+                    '-y',
+                    target["out_path"]
+                ]
+
+            run_ffmpeg([
+                FFMPEG_PATH,
+                *inputs,
+                '-i', audio_path,
+                *filter_args,
+                *outputs
+            ], duration, job, stdin)
+    except Exception:
+        if job and job.cancelled:
+            for target in targets:
+                if os.path.exists(target["out_path"]):
+                    os.remove(target["out_path"])
+        raise
+
+    return [target["out_path"] for target in targets]
@@ -0,0 +1,118 @@
+import os, socket, threading, time, uuid, argparse, jobs, metrics, render_queue
+
+# как часто свободный воркер проверяет очередь
+POLL_INTERVAL = 1.0
+# ошибки во входных данных: повтор не поможет
+PERMANENT_ERRORS = (ValueError, FileNotFoundError)
+
+_workers = []
+_workers_lock = threading.Lock()
+
+def _heartbeat(job, record, done, lost, stop):
+    # продлевает аренду и переносит прогресс в очередь; отмена, потеря аренды и остановка воркера прерывают рендер
+    while not done.wait(render_queue.HEARTBEAT):
+        if stop.is_set():
+            job.cancel()
+
+        try:
+            owned, cancel = render_queue.heartbeat(record["id"], record["lease_token"], job.progress, list(job.timings))
+        except Exception as e:
+            print(f"Ошибка продления аренды {record['id']}: {e}")
+            continue
+
+        if not owned:
+            lost.set()
+        if not owned or cancel:
+            job.cancel()
+
+def run_job(record, stop):
+    job_id, token = record["id"], record["lease_token"]
+    job = jobs.Job(job_id)
+    job.status = "running"
+    done, lost = threading.Event(), threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job, record, done, lost, stop), daemon=True, name=f"heartbeat-{job_id[:8]}")
+    heartbeat.start()
+
+    try:
+        fn = jobs.tasks.get(record["task"])
+        if fn is None:
+            raise ValueError(f"Неизвестная задача: {record['task']}")
+
+        payload = record["payload"]
+        with metrics.collect(job.timings):
+            metrics.record("queue", time.time() - record["created"])
+            result = fn(*payload["args"], job=job, **payload["kwargs"])
+        status, error = "done", None
+    except Exception as e:
+        status, error = ("cancelled" if job.cancelled else "error"), str(e)
+        if isinstance(e, jobs.JobCancelled):
+            error = None
+        elif not job.cancelled and not isinstance(e, PERMANENT_ERRORS):
+            status = "retry"
+        result = None
+    finally:
+        done.set()
+        heartbeat.join()
+
+    if lost.is_set():
+        # аренда истекла, задачу уже забрал другой воркер
+        return
+    if status == "cancelled" and stop.is_set():
+        # остановка воркера, а не отмена пользователем: задача вернется в очередь
+        render_queue.release(job_id, token)
+    elif status == "retry":
+        render_queue.retry(job_id, token, error, job.timings)
+    else:
+        render_queue.finish(job_id, token, status, result, error, job.timings)
+
+def run(worker_id, stop):
+    while not stop.is_set():
+        try:
+            record = render_queue.claim(worker_id)
+        except Exception as e:
+            print(f"Ошибка чтения очереди: {e}")
+            record = None
+
+        if record is None:
+            stop.wait(POLL_INTERVAL)
+            continue
+        run_job(record, stop)
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def start(count, stop=None):
+    # воркеры в потоках текущего процесса; повторный вызов ничего не добавляет
+    stop = stop or threading.Event()
+    with _workers_lock:
+        while len(_workers) < count:
+            thread = threading.Thread(target=run, args=(worker_id(), stop), daemon=True, name=f"render-{len(_workers)}")
+            thread.start()
+            _workers.append(thread)
+    return stop
+
+def main():
+    parser = argparse.ArgumentParser(description="Воркер рендера VibeMaker: берет задачи из общей очереди")
+    parser.add_argument("--threads", type=int, default=1, help="сколько задач выполнять одновременно")
+    parser.add_argument("--queue", help="путь к файлу очереди (по умолчанию VIBEMAKER_QUEUE или cache/queue.sqlite3)")
+    args = parser.parse_args()
+
+    if args.queue:
+        render_queue.QUEUE_PATH = os.path.abspath(args.queue)
+
+    # задачи регистрируются при импорте приложения
+    import app
+
+    stop = start(args.threads)
+    print(f"Воркер запущен: {args.threads} поток(ов), очередь {render_queue.QUEUE_PATH}")
+    try:
+        while any(thread.is_alive() for thread in _workers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Остановка: текущие задачи вернутся в очередь")
+        stop.set()
+        for thread in _workers:
+            thread.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import os, re, shutil, threading, time, uuid
+from flask import current_app, g, request
+
+COOKIE_NAME = "workspace"
+
+# рабочая папка удаляется, если сессия не обращалась к ней дольше TTL
+WORKSPACE_TTL = 24 * 60 * 60
+# общий лимит на папки загрузок и временных файлов; сверх него удаляются самые старые сессии
+DISK_QUOTA = 5 * 1024 * 1024 * 1024
+# недавно активные сессии не удаляются даже при превышении лимита
+ACTIVE_GRACE = 15 * 60
+JANITOR_INTERVAL = 5 * 60
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+_janitor = None
+_janitor_lock = threading.Lock()
+
+def _roots():
+    return [current_app.config["UPLOAD_FOLDER"], current_app.config["TEMP_FOLDER"]]
+
+def current():
+    # id рабочей папки сессии из cookie; при первом обращении создается новый
+    ws_id = g.get("workspace")
+    if ws_id is None:
+        ws_id = request.cookies.get(COOKIE_NAME, "")
+        if not _ID_RE.match(ws_id):
+            ws_id = uuid.uuid4().hex
+            g.new_workspace = True
+
+        g.workspace = ws_id
+        touch(ws_id)
+
+    return ws_id
+
+def _dir(root, ws_id):
+    path = os.path.join(root, ws_id or current())
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def upload_dir(ws_id=None):
+    return _dir(current_app.config["UPLOAD_FOLDER"], ws_id)
+
+def temp_dir(ws_id=None):
+    return _dir(current_app.config["TEMP_FOLDER"], ws_id)
+
+def touch(ws_id):
+    for root in _roots():
+        path = os.path.join(root, ws_id)
+        if os.path.isdir(path):
+            os.utime(path)
+
+def workspace_of(path):
+    # id рабочей папки, в которой лежит файл, или None
+    if not isinstance(path, str):
+        return None
+
+    path = os.path.abspath(path)
+    for root in _roots():
+        try:
+            rel = os.path.relpath(path, os.path.abspath(root))
+        except ValueError:
+            continue
+        ws_id = rel.split(os.sep, 1)[0]
+        if not rel.startswith("..") and _ID_RE.match(ws_id):
+            return ws_id
+
+    return None
+
+def pins_for(*paths):
+    # что держит задача: рабочие папки с ее файлами, а файлы вне рабочих папок - по пути
+    pins = set()
+    for path in paths:
+        if isinstance(path, str) and os.path.isfile(path):
+            pins.add(workspace_of(path) or os.path.abspath(path))
+    return pins
+
+def _size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+def _collect(roots):
+    # {id: [время последней активности, размер, пути]}; файлы вне рабочих папок - каждый сам по себе
+    entries = {}
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            try:
+                mtime, size = os.stat(path).st_mtime, _size(path)
+            except OSError:
+                continue
+
+            key = name if _ID_RE.match(name) and os.path.isdir(path) else path
+            entry = entries.setdefault(key, [0, 0, []])
+            entry[0] = max(entry[0], mtime)
+            entry[1] += size
+            entry[2].append(path)
+    return entries
+
+def _remove(paths):
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except Exception as e:
+            print(f"Ошибка удаления {path}: {e}")
+
+def sweep(roots, pinned=()):
+    now = time.time()
+    entries = _collect(roots)
+    total = sum(size for _, size, _ in entries.values())
+
+    # сначала самые давно неактивные
+    for key, (last, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+        if key in pinned:
+            continue
+
+        idle = now - last
+        if idle > WORKSPACE_TTL or (total > DISK_QUOTA and idle > ACTIVE_GRACE):
+            _remove(paths)
+            total -= size
+
+def _run_janitor(roots, pinned):
+    while True:
+        time.sleep(JANITOR_INTERVAL)
+        try:
+            sweep(roots, pinned())
+        except Exception as e:
+            print(f"Ошибка очистки рабочих папок: {e}")
+
+def start_janitor(pinned=lambda: ()):
+    # pinned() - id рабочих папок, файлы которых сейчас используются задачами
+    global _janitor
+
+    with _janitor_lock:
+        if _janitor is None:
+            _janitor = threading.Thread(target=_run_janitor, args=(_roots(), pinned), daemon=True, name="workspace-janitor")
+            _janitor.start()